@@ -0,0 +1,403 @@
+import base64
+import fnmatch
+import json
+import os
+import pathlib
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tarfile
+import time
+import zipfile
+import zlib
+
+state = pathlib.Path(os.environ["CUBUZOA_BENCHMARK_STATE"])
+configuration = json.loads(os.environ.get("CUBUZOA_BENCHMARK_CONFIGURATION", "{}"))
+machine_to_port = {"linux": 2201, "macos": 2202, "windows": 2203}
+guest_homes = (
+    "/home/vagrant",
+    "/Users/vagrant",
+    "C:\\Users\\vagrant",
+    "C:/Users/vagrant",
+)
+agent_marker = "cubuzoa-agent:"
+
+
+def sleep(*keys: str) -> None:
+    for key in keys:
+        if key in configuration["latency"]:
+            time.sleep(configuration["latency"][key])
+            return
+
+
+def guest(machine: str) -> pathlib.Path:
+    home = state / "guests" / machine
+    home.mkdir(parents=True, exist_ok=True)
+    return home
+
+
+def load_machine(machine: str) -> dict:
+    path = guest(machine) / ".machine.json"
+    if path.is_file():
+        with open(path) as machine_file:
+            return json.load(machine_file)
+    return {"state": "not_created", "snapshots": []}
+
+
+def save_machine(machine: str, machine_state: dict) -> None:
+    with open(guest(machine) / ".machine.json", "w") as machine_file:
+        json.dump(machine_state, machine_file)
+
+
+def port_to_machine(port: int) -> str:
+    for machine, machine_port in machine_to_port.items():
+        if machine_port == port:
+            return machine
+    raise Exception(f"unknown port {port}")
+
+
+def uuid_to_machine(uuid: str) -> str:
+    return uuid[len("cubuzoa-benchmark-") :]
+
+
+def ignored(name: str, patterns: list[str]) -> bool:
+    return name == ".git" or any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def tree(root: pathlib.Path, filter_gitignore: bool) -> list[pathlib.Path]:
+    paths: list[pathlib.Path] = []
+    patterns: list[str] = []
+    if filter_gitignore and (root / ".gitignore").is_file():
+        with open(root / ".gitignore") as gitignore:
+            patterns = [
+                line.strip().strip("/")
+                for line in gitignore
+                if len(line.strip()) > 0 and not line.startswith("#")
+            ]
+    for directory, directories, files in os.walk(root):
+        directories[:] = [name for name in directories if not ignored(name, patterns)]
+        for name in sorted(directories):
+            paths.append((pathlib.Path(directory) / name).relative_to(root))
+        for name in sorted(files):
+            if not ignored(name, patterns):
+                paths.append((pathlib.Path(directory) / name).relative_to(root))
+    return paths
+
+
+def write_artifact(path: pathlib.Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as artifact:
+        artifact.write(os.urandom(configuration["artifact_size"]))
+
+
+def write_wheel(path: pathlib.Path, extension_module: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(path, "w") as wheel:
+        wheel.writestr(
+            f"benchmark/{extension_module}",
+            os.urandom(configuration["artifact_size"]),
+        )
+
+
+def emulate_step(machine: str, job: dict, step: dict) -> None:
+    command = step["command"]
+    if not isinstance(command, str):
+        command = " ".join(command)
+    sleep(f"step {step['name']}", "step")
+    home = guest(machine)
+    match = re.search(r"--distpath (\S+) -n (\S+)", command)
+    if match is not None:
+        version = re.split(r"[/\\]", match.group(1))[-1]
+        shutil.rmtree(home / "build" / version / match.group(2), ignore_errors=True)
+        write_artifact(home / "build" / version / match.group(2) / match.group(2))
+        return
+    match = re.search(r"wheels[/\\](\d+\.\d+)[/\\]", command)
+    if step["name"] == "collect" and match is not None:
+        version = match.group(1)
+        tag = "cp{}".format(version.replace(".", ""))
+        if machine == "linux":
+            platform = "manylinux2014_x86_64"
+            extension_module = f"_core.cpython-{tag[2:]}-x86_64-linux-gnu.so"
+        elif machine == "macos":
+            platform = "macosx_10_9_x86_64"
+            extension_module = f"_core.cpython-{tag[2:]}-darwin.so"
+        elif "32" in json.dumps(job) and "(x86)" in json.dumps(job):
+            platform = "win32"
+            extension_module = f"_core.{tag}-win32.pyd"
+        else:
+            platform = "win_amd64"
+            extension_module = f"_core.{tag}-win_amd64.pyd"
+        write_wheel(
+            home / "wheels" / version / f"benchmark-0.1.0-{tag}-{tag}-{platform}.whl",
+            extension_module,
+        )
+
+
+def emulate_agent(machine: str, payload: str) -> int:
+    job = json.loads(zlib.decompress(base64.b64decode(payload)).decode("utf-8"))
+    for step in job["steps"]:
+        print(agent_marker + json.dumps({"event": "start", "step": step["name"]}))
+        begin = time.monotonic()
+        emulate_step(machine, job, step)
+        print(
+            agent_marker
+            + json.dumps(
+                {
+                    "event": "end",
+                    "step": step["name"],
+                    "returncode": 0,
+                    "duration": time.monotonic() - begin,
+                }
+            )
+        )
+    return 0
+
+
+def emulate_tar(machine: str, command: str) -> int:
+    match = re.search(r"tar(?:\.exe)? -x(z?)f - -C (\S+)$", command)
+    assert match is not None
+    target = guest(machine) / match.group(2)
+    if "rm -rf" in command or "rmdir /s /q" in command:
+        shutil.rmtree(target, ignore_errors=True)
+    target.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(
+        fileobj=sys.stdin.buffer, mode="r|gz" if match.group(1) == "z" else "r|"
+    ) as archive:
+        archive.extractall(target)
+    return 0
+
+
+def emulate_command(machine: str, command: str) -> int:
+    sleep("command")
+    match = re.search(r"/usr/bin/docker (run|exec|rm|save|load) ", command)
+    if match is not None:
+        sleep(f"guest docker {match.group(1)}")
+        if match.group(1) == "save":
+            sys.stdout.buffer.write(os.urandom(configuration["artifact_size"]))
+            return 0
+        if match.group(1) == "load":
+            sys.stdin.buffer.read()
+            print("Loaded image: manylinux:latest")
+            return 0
+    if "agent.py " in command:
+        return emulate_agent(machine, command.split()[-1])
+    if " -C " in command and "tar" in command:
+        return emulate_tar(machine, command)
+    match = re.search(r' -c "(.*)"$', command)
+    if match is not None:
+        code = match.group(1)
+        for guest_home in guest_homes:
+            code = code.replace(guest_home.replace("\\", "/"), str(guest(machine)))
+            code = code.replace(guest_home, str(guest(machine)))
+        return subprocess.run(
+            (sys.executable, "-c", code), cwd=guest(machine)
+        ).returncode
+    return 0
+
+
+def vagrant(args: list[str]) -> int:
+    machine = pathlib.Path.cwd().name
+    subcommand = args[0] if len(args) > 0 else ""
+    sleep(f"vagrant {subcommand}", "vagrant")
+    machine_state = load_machine(machine)
+    if subcommand in {"plugin", "box"}:
+        return 0
+    if subcommand == "status":
+        return 0 if (pathlib.Path.cwd() / "Vagrantfile").is_file() else 1
+    if subcommand == "up":
+        if (pathlib.Path.cwd() / "Vagrantfile").is_file():
+            with open(pathlib.Path.cwd() / "Vagrantfile") as vagrantfile:
+                if "docker build" in vagrantfile.read():
+                    sleep("guest docker build")
+        if (pathlib.Path.cwd() / "resources.json").is_file():
+            with open(pathlib.Path.cwd() / "resources.json") as resources_file:
+                machine_state.update(json.load(resources_file))
+        identifier = (
+            pathlib.Path.cwd() / ".vagrant" / "machines" / "default" / "virtualbox"
+        )
+        identifier.mkdir(parents=True, exist_ok=True)
+        with open(identifier / "id", "w") as identifier_file:
+            identifier_file.write(f"cubuzoa-benchmark-{machine}")
+        machine_state["state"] = "running"
+    elif subcommand == "suspend":
+        machine_state["state"] = "saved"
+    elif subcommand in {"resume", "reload"}:
+        machine_state["state"] = "running"
+    elif subcommand == "halt":
+        machine_state["state"] = "poweroff"
+    elif subcommand == "destroy":
+        shutil.rmtree(guest(machine))
+        return 0
+    elif subcommand == "ssh-config":
+        if machine_state["state"] != "running":
+            return 1
+        print(
+            "\n".join(
+                (
+                    "Host default",
+                    "  HostName 127.0.0.1",
+                    "  User vagrant",
+                    f"  Port {machine_to_port[machine]}",
+                    f"  IdentityFile {state / 'key'}",
+                )
+            )
+        )
+        return 0
+    elif subcommand == "port":
+        print(machine_to_port[machine])
+        return 0
+    elif subcommand == "ssh":
+        return emulate_command(machine, " ".join(args[args.index("--") + 1 :]))
+    save_machine(machine, machine_state)
+    return 0
+
+
+def vboxmanage(args: list[str]) -> int:
+    sleep(f"VBoxManage {args[0]}", "VBoxManage")
+    if args[0] == "list":
+        return 0
+    machine = uuid_to_machine(args[1])
+    machine_state = load_machine(machine)
+    if args[0] == "showvminfo":
+        print(f'VMState="{machine_state["state"]}"')
+        print(f'cpus={machine_state.get("cpus", 1)}')
+        print(f'memory={machine_state.get("memory", 1024)}')
+        return 0
+    if args[0] == "snapshot":
+        if args[2] == "list":
+            for index, name in enumerate(machine_state["snapshots"]):
+                print(f'SnapshotName{"" if index == 0 else f"-{index}"}="{name}"')
+            return 0 if len(machine_state["snapshots"]) > 0 else 1
+        if args[2] == "take":
+            machine_state["snapshots"].append(args[3])
+        elif args[2] == "delete":
+            machine_state["snapshots"].remove(args[3])
+        elif args[2] == "restore":
+            machine_state["state"] = "saved"
+    elif args[0] == "controlvm" and args[2] == "poweroff":
+        machine_state["state"] = "poweroff"
+    elif args[0] == "controlvm" and args[2] == "resume":
+        machine_state["state"] = "running"
+    elif args[0] == "modifyvm":
+        if machine_state["state"] not in {"poweroff", "aborted"}:
+            print(f"VBoxManage: error: The machine is {machine_state['state']}")
+            return 1
+        for option, value in zip(args[2::2], args[3::2]):
+            machine_state[option[2:]] = int(value)
+    elif args[0] == "discardstate":
+        machine_state["state"] = "poweroff"
+    elif args[0] == "startvm":
+        machine_state["state"] = "running"
+    save_machine(machine, machine_state)
+    return 0
+
+
+def ssh(args: list[str]) -> int:
+    sleep("ssh")
+    port = 22
+    index = 0
+    while index < len(args) and args[index].startswith("-"):
+        if args[index] == "-O":
+            return 0
+        if args[index] == "-p":
+            port = int(args[index + 1])
+        index += 1 if args[index] in {"-T", "-q"} else 2
+    return emulate_command(port_to_machine(port), " ".join(args[index + 1 :]))
+
+
+def rsync(args: list[str]) -> int:
+    sleep("rsync")
+    options = [argument for argument in args if argument.startswith("-")]
+    paths: list[str] = []
+    index = 0
+    port = 22
+    while index < len(args):
+        if args[index] == "-e":
+            ssh_arguments = shlex.split(args[index + 1])
+            port = int(ssh_arguments[ssh_arguments.index("-p") + 1])
+            index += 2
+            continue
+        if not args[index].startswith("-"):
+            paths.append(args[index])
+        index += 1
+    source, target = paths
+    filter_gitignore = "--filter=:- .gitignore" in options
+    if "--dry-run" in options:
+        for path in tree(pathlib.Path(source), filter_gitignore):
+            print(
+                f"{path.as_posix()}/"
+                if (pathlib.Path(source) / path).is_dir()
+                else path.as_posix()
+            )
+        return 0
+    if ":" in source and not pathlib.Path(source).exists():
+        source_root = guest(port_to_machine(port)) / source.partition(":")[2]
+        target_root = pathlib.Path(target)
+    else:
+        source_root = pathlib.Path(source)
+        target_root = guest(port_to_machine(port)) / target.partition(":")[2]
+    if not source_root.exists():
+        print(f'rsync: change_dir "{source_root}" failed: No such file or directory')
+        return 23
+    files_from = [option for option in options if option.startswith("--files-from=")]
+    if len(files_from) > 0:
+        with open(files_from[0][len("--files-from=") :], "rb") as files_file:
+            paths_to_copy = [
+                pathlib.Path(os.fsdecode(name))
+                for name in files_file.read().split(
+                    b"\0" if "--from0" in options else b"\n"
+                )
+                if len(name) > 0
+            ]
+    else:
+        paths_to_copy = tree(source_root, filter_gitignore)
+    if "--delete" in options and target_root.is_dir():
+        kept = set(paths_to_copy)
+        for path in reversed(tree(target_root, False)):
+            if not path in kept:
+                if (target_root / path).is_dir():
+                    shutil.rmtree(target_root / path)
+                else:
+                    (target_root / path).unlink()
+    target_root.mkdir(parents=True, exist_ok=True)
+    for path in paths_to_copy:
+        if (source_root / path).is_dir():
+            (target_root / path).mkdir(parents=True, exist_ok=True)
+        else:
+            (target_root / path).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(source_root / path, target_root / path)
+    return 0
+
+
+def docker(args: list[str]) -> int:
+    sleep(f"docker {args[0]}" if len(args) > 0 else "docker", "docker")
+    return 0
+
+
+if __name__ == "__main__":
+    tool = sys.argv[1]
+    begin = time.time()
+    returncode = {
+        "vagrant": vagrant,
+        "VBoxManage": vboxmanage,
+        "ssh": ssh,
+        "rsync": rsync,
+        "docker": docker,
+    }[tool](sys.argv[2:])
+    sys.stdout.flush()
+    with open(state / "calls.jsonl", "a") as calls:
+        calls.write(
+            json.dumps(
+                {
+                    "tool": tool,
+                    "arguments": sys.argv[2:4],
+                    "begin": begin,
+                    "end": time.time(),
+                    "returncode": returncode,
+                }
+            )
+            + "\n"
+        )
+    sys.exit(returncode)
@@ -0,0 +1,316 @@
+import argparse
+import json
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+dirname = pathlib.Path(__file__).resolve().parent
+tools = ("vagrant", "VBoxManage", "ssh", "rsync", "docker")
+backend_to_pyproject = {
+    "setuptools": "\n".join(
+        (
+            "[build-system]",
+            'requires = ["setuptools", "wheel"]',
+            'build-backend = "setuptools.build_meta"',
+        )
+    ),
+    "maturin": "\n".join(
+        (
+            "[build-system]",
+            'requires = ["maturin>=0.13,<0.14"]',
+            'build-backend = "maturin"',
+        )
+    ),
+    "pyinstaller": "\n".join(
+        (
+            "[build-system]",
+            'requires = ["pyinstaller"]',
+            'build-backend = "pyinstaller"',
+            "",
+            "[tool.pyinstaller]",
+            'name = "benchmark"',
+            'scriptnames = ["benchmark/__main__.py"]',
+        )
+    ),
+}
+
+
+def create_project(
+    directory: pathlib.Path, backend: str, files: int, file_size: int, git: bool
+) -> None:
+    (directory / "benchmark").mkdir(parents=True)
+    with open(directory / "pyproject.toml", "w") as pyproject:
+        pyproject.write(backend_to_pyproject[backend])
+    with open(directory / ".gitignore", "w") as gitignore:
+        gitignore.write("wheels\nbuild\n")
+    with open(directory / "benchmark" / "__main__.py", "w") as main:
+        main.write("print('benchmark')\n")
+    for index in range(files):
+        with open(directory / "benchmark" / f"module_{index}.py", "wb") as module:
+            module.write(os.urandom(file_size))
+    (directory / "build" / "ignored").mkdir(parents=True)
+    for index in range(files):
+        with open(
+            directory / "build" / "ignored" / f"object_{index}.o", "wb"
+        ) as ignored:
+            ignored.write(os.urandom(file_size))
+    if git:
+        subprocess.run(("git", "init", "--quiet"), cwd=directory, check=True)
+
+
+def create_tools(directory: pathlib.Path) -> None:
+    directory.mkdir(parents=True)
+    for tool in tools:
+        with open(directory / tool, "w") as script:
+            script.write(
+                f'#!/bin/sh\nexec "{sys.executable}" "{dirname / "fake.py"}" {tool} "$@"\n'
+            )
+        (directory / tool).chmod(0o755)
+
+
+def run(
+    name: str,
+    arguments: list[str],
+    environment: dict[str, str],
+    state: pathlib.Path,
+    verbose: bool,
+) -> dict:
+    calls_path = state / "calls.jsonl"
+    if calls_path.exists():
+        calls_path.unlink()
+    begin = time.monotonic()
+    result = subprocess.run(
+        (sys.executable, "-m", "cubuzoa", *arguments),
+        cwd=dirname.parent,
+        env=environment,
+        stdout=None if verbose else subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        encoding="utf-8",
+    )
+    duration = time.monotonic() - begin
+    if result.returncode != 0:
+        if not verbose:
+            print(result.stdout)
+        raise Exception(f'"{name}" failed with exit code {result.returncode}')
+    tool_to_count = {tool: 0 for tool in tools}
+    tool_to_duration = {tool: 0.0 for tool in tools}
+    if calls_path.exists():
+        with open(calls_path) as calls:
+            for line in calls:
+                call = json.loads(line)
+                tool_to_count[call["tool"]] += 1
+                tool_to_duration[call["tool"]] += call["end"] - call["begin"]
+    return {
+        "name": name,
+        "duration": duration,
+        "counts": tool_to_count,
+        "durations": tool_to_duration,
+    }
+
+
+def print_results(results: list[dict]) -> None:
+    width = max(len(result["name"]) for result in results)
+    print(
+        " | ".join(
+            (
+                f"{'command':<{width}}",
+                f"{'wall (s)':>8}",
+                *(f"{tool:>10}" for tool in tools),
+                f"{'total':>6}",
+            )
+        )
+    )
+    for result in results:
+        print(
+            " | ".join(
+                (
+                    f"{result['name']:<{width}}",
+                    f"{result['duration']:>8.2f}",
+                    *(f"{result['counts'][tool]:>10}" for tool in tools),
+                    f"{sum(result['counts'].values()):>6}",
+                )
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure cubuzoa's orchestration overhead with fake vagrant, VBoxManage, ssh, rsync and docker executables",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--backend",
+        nargs="+",
+        choices=sorted(backend_to_pyproject.keys()),
+        default=sorted(backend_to_pyproject.keys()),
+        help="backends to build",
+    )
+    parser.add_argument(
+        "--files",
+        type=int,
+        nargs="+",
+        default=[10, 1000],
+        help="number of files in the synthetic projects",
+    )
+    parser.add_argument(
+        "--file-size", type=int, default=4096, help="size of each project file in bytes"
+    )
+    parser.add_argument(
+        "--artifact-size",
+        type=int,
+        default=1 << 20,
+        help="size of each fake wheel or frozen package in bytes",
+    )
+    parser.add_argument(
+        "--latency",
+        action="append",
+        default=[],
+        metavar="KEY=SECONDS",
+        help='fake latency, KEY is a tool ("vagrant", "VBoxManage", "ssh", "rsync" or "docker"), a tool and a subcommand ("vagrant up"), "command" (each guest command), "guest docker build", "guest docker run", "guest docker exec", "guest docker rm", "guest docker save" or "guest docker load" (image and container commands in the Linux guest), "step" (each build step) or "step NAME" (for instance "step wheel")',
+    )
+    parser.add_argument("--os", default=".*", help="operating system regex")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=3,
+        help="maximum number of operating systems built concurrently",
+    )
+    parser.add_argument(
+        "--no-git",
+        action="store_true",
+        help="do not initialize git repositories in the synthetic projects (the uploads walk the projects with rsync filters)",
+    )
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the temporary directory"
+    )
+    parser.add_argument("--verbose", action="store_true", help="show cubuzoa's output")
+    args = parser.parse_args()
+    latency = {
+        "vagrant up": 0.5,
+        "guest docker build": 2.0,
+        "guest docker run": 0.5,
+        "step": 0.1,
+    }
+    for entry in args.latency:
+        key, _, value = entry.rpartition("=")
+        latency[key] = float(value)
+    directory = pathlib.Path(tempfile.mkdtemp(prefix="cubuzoa-benchmark-"))
+    try:
+        state = directory / "state"
+        state.mkdir()
+        (directory / "output").mkdir()
+        create_tools(directory / "bin")
+        environment = dict(os.environ)
+        environment["PATH"] = f"{directory / 'bin'}{os.pathsep}{environment['PATH']}"
+        environment["CUBUZOA_BENCHMARK_STATE"] = str(state)
+        environment["CUBUZOA_BENCHMARK_CONFIGURATION"] = json.dumps(
+            {"latency": latency, "artifact_size": args.artifact_size}
+        )
+        environment["ANSI_COLORS_DISABLED"] = "1"
+        build = directory / "build"
+        results: list[dict] = []
+
+        def benchmark(name: str, arguments: list[str]) -> None:
+            results.append(run(name, arguments, environment, state, args.verbose))
+            print(
+                f"{name}: {results[-1]['duration']:.2f} s, {sum(results[-1]['counts'].values())} subprocesses",
+                flush=True,
+            )
+
+        image_cache = ["--image-cache", str(directory / "images")]
+        benchmark(
+            "provision",
+            ["provision", "--os", args.os, "--build", str(build), *image_cache],
+        )
+        benchmark(
+            "provision (cached image)",
+            [
+                "provision",
+                "--os",
+                args.os,
+                "--build",
+                str(build),
+                "--force",
+                *image_cache,
+            ],
+        )
+        for backend in args.backend:
+            for files in args.files:
+                project = directory / "projects" / f"{backend}-{files}"
+                create_project(project, backend, files, args.file_size, not args.no_git)
+                for label, extra_arguments in (
+                    ("", []),
+                    (" (cached)", []),
+                    (" (incremental)", ["--no-cache", "--incremental"]),
+                ):
+                    benchmark(
+                        f"build {backend} {files} files{label}",
+                        [
+                            "build",
+                            str(project),
+                            "--os",
+                            args.os,
+                            "--build",
+                            str(build),
+                            "--cache",
+                            str(directory / "cache"),
+                            "--output",
+                            str(directory / "output" / f"{backend}-{files}"),
+                            "--jobs",
+                            str(args.jobs),
+                            *extra_arguments,
+                        ],
+                    )
+        benchmark("suspend", ["suspend", "--os", args.os, "--build", str(build)])
+        project = directory / "projects" / "suspended"
+        create_project(
+            project, args.backend[0], args.files[0], args.file_size, not args.no_git
+        )
+        benchmark(
+            "build (suspended machines)",
+            [
+                "build",
+                str(project),
+                "--os",
+                args.os,
+                "--build",
+                str(build),
+                "--no-cache",
+                "--output",
+                str(directory / "output" / "suspended"),
+                "--jobs",
+                str(args.jobs),
+                "--suspend-after",
+            ],
+        )
+        for command in ("resume", "halt", "up"):
+            benchmark(command, [command, "--os", args.os, "--build", str(build)])
+        benchmark("unprovision", ["unprovision", "--build", str(build)])
+        print()
+        print_results(results)
+        if args.json is not None:
+            with open(args.json, "w") as json_file:
+                json.dump(
+                    {
+                        "configuration": {
+                            "backend": args.backend,
+                            "files": args.files,
+                            "file_size": args.file_size,
+                            "artifact_size": args.artifact_size,
+                            "latency": latency,
+                        },
+                        "results": results,
+                    },
+                    json_file,
+                    indent=4,
+                )
+    finally:
+        if args.keep:
+            print(f"kept {directory}")
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
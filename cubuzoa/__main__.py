@@ -1,12 +1,17 @@
 import argparse
+import functools
 import importlib
 import packaging.specifiers
+import packaging.version
 import pathlib
 import re
 import shutil
 import subprocess
 import sys
+import threading
+import time
 import toml
+import typing
 from . import common
 
 dirname = pathlib.Path(__file__).resolve().parent
@@ -32,12 +37,60 @@ if __name__ == "__main__":
     provision_parser.add_argument(
         "--build", default=str(dirname.parent / "build"), help="build directory"
     )
+    provision_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=len(common.os_to_configuration),
+        help="maximum number of operating systems provisioned concurrently",
+    )
+    provision_parser.add_argument(
+        "--max-vms",
+        type=int,
+        default=len(common.os_to_configuration),
+        help="maximum number of Virtual Machines running at once during provisioning, machines are suspended after provisioning if this is lower than the number of operating systems",
+    )
+    provision_parser.add_argument(
+        "--cpus",
+        type=int,
+        default=None,
+        help="number of virtual CPUs of each Virtual Machine, defaults to half of the host's CPUs (at least 2)",
+    )
+    provision_parser.add_argument(
+        "--memory",
+        type=int,
+        default=None,
+        help="memory of each Virtual Machine in MB, defaults to the host's memory divided by the number of operating systems plus one (between 2048 and 16384)",
+    )
+    provision_parser.add_argument(
+        "--wheelhouse",
+        default=None,
+        help="requirements file (one requirement per line) of the build dependencies downloaded into each guest's wheelhouse, defaults to {}".format(
+            " ".join(common.default_wheelhouse_requirements)
+        ),
+    )
+    provision_parser.add_argument(
+        "--image-cache",
+        default=str(dirname.parent / "cache-images"),
+        help="directory of the manylinux image archives, the Linux provisioning loads the archive that matches its Dockerfile instead of building the image, and saves the built image otherwise",
+    )
+    provision_parser.add_argument(
+        "--no-image-cache",
+        action="store_true",
+        help="always build the manylinux image and do not save it",
+    )
     build_parser = subparsers.add_parser(
         "build",
         help="build a Python project",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
-    build_parser.add_argument("project", help="path to the project directory")
+    build_parser.add_argument(
+        "project", nargs="*", help="paths to the project directories"
+    )
+    build_parser.add_argument(
+        "--manifest",
+        default=None,
+        help="path to a TOML file that lists projects to build, in addition to the positional projects",
+    )
     build_parser.add_argument(
         "--pre",
         default=None,
@@ -51,7 +104,7 @@ if __name__ == "__main__":
     build_parser.add_argument(
         "--output",
         default=None,
-        help="path to the output directory, defaults to [project]/wheels for wheels and [project]/build for frozen packages",
+        help="path to the output directory, defaults to [project]/wheels for wheels and [project]/build for frozen packages, each project writes to [output]/[project name] if there are several projects",
     )
     build_parser.add_argument(
         "--os", default=".*", help="operating system regex, case insensitive"
@@ -62,6 +115,110 @@ if __name__ == "__main__":
     build_parser.add_argument(
         "--build", default=str(dirname.parent / "build"), help="build directory"
     )
+    build_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=len(common.os_to_configuration),
+        help="maximum number of operating systems built concurrently",
+    )
+    build_parser.add_argument(
+        "--linux-jobs",
+        type=int,
+        default=1,
+        help="maximum number of Python versions built concurrently in separate workspaces on Linux",
+    )
+    build_parser.add_argument(
+        "--windows-jobs",
+        type=int,
+        default=1,
+        help="maximum number of (Python version, architecture) pairs built concurrently in separate workspaces on Windows",
+    )
+    build_parser.add_argument(
+        "--macos-jobs",
+        type=int,
+        default=1,
+        help="maximum number of Python versions built concurrently in separate workspaces on macOS",
+    )
+    build_parser.add_argument(
+        "--cache",
+        default=str(dirname.parent / "cache"),
+        help="wheels and frozen packages cache directory",
+    )
+    build_parser.add_argument(
+        "--cache-size",
+        type=float,
+        default=10.0,
+        help="maximum cache size in GB, least recently used entries are deleted first",
+    )
+    build_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="build every version even if the cache contains a matching entry",
+    )
+    build_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="keep the project directory on the guest between builds and only upload changes",
+    )
+    build_parser.add_argument(
+        "--upload",
+        choices=["auto", "rsync", "tar"],
+        default="auto",
+        help="project upload method, auto streams a tar archive over SSH when the guest project directory is empty and uses rsync otherwise",
+    )
+    build_parser.add_argument(
+        "--upload-compression",
+        type=int,
+        choices=range(0, 10),
+        default=1,
+        metavar="{0,...,9}",
+        help="gzip compression level of the project upload, 0 disables compression",
+    )
+    build_parser.add_argument(
+        "--compiler-cache",
+        action="store_true",
+        help="cache compiler outputs on the guests (sccache for maturin, ccache for setuptools)",
+    )
+    build_parser.add_argument(
+        "--reset",
+        choices=["none", "snapshot"],
+        default="none",
+        help="restore the snapshot taken after provisioning before building",
+    )
+    abi_group = build_parser.add_mutually_exclusive_group()
+    abi_group.add_argument(
+        "--abi3",
+        action="store_true",
+        help="build one abi3 wheel per operating system with the oldest selected Python version",
+    )
+    abi_group.add_argument(
+        "--pure",
+        action="store_true",
+        help="build a single pure Python wheel on the first selected operating system",
+    )
+    build_parser.add_argument(
+        "--compiler-cache-size",
+        type=float,
+        default=5.0,
+        help="maximum size of each guest compiler cache in GB",
+    )
+    build_parser.add_argument(
+        "--suspend-after",
+        action="store_true",
+        help="suspend the Virtual Machines used by the build when it finishes",
+    )
+    build_parser.add_argument(
+        "--idle-suspend",
+        type=float,
+        default=None,
+        metavar="MINUTES",
+        help="suspend the Virtual Machines used by the build after this many minutes without builds, with a background process",
+    )
+    build_parser.add_argument(
+        "--trace",
+        default=None,
+        help="write a Chrome trace (JSON, can be opened with https://ui.perfetto.dev) of the build phases to this file",
+    )
     for subcommand in ["suspend", "resume", "halt", "up"]:
         subparser = subparsers.add_parser(
             subcommand,
@@ -74,6 +231,158 @@ if __name__ == "__main__":
         subparser.add_argument(
             "--build", default=str(dirname.parent / "build"), help="build directory"
         )
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help="run a build server that queues the builds submitted with python3 -m cubuzoa submit",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    serve_parser.add_argument(
+        "--build", default=str(dirname.parent / "build"), help="build directory"
+    )
+    serve_parser.add_argument(
+        "--socket",
+        default=None,
+        help="path to the server's Unix socket, defaults to [build]/serve.sock",
+    )
+    serve_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=len(common.os_to_configuration),
+        help="maximum number of builds running at once, builds that use the same operating system never run at once",
+    )
+    submit_parser = subparsers.add_parser(
+        "submit",
+        help="queue a build on the build server and stream its output",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    submit_parser.add_argument(
+        "--socket",
+        default=str(dirname.parent / "build" / "serve.sock"),
+        help="path to the server's Unix socket",
+    )
+    submit_parser.add_argument(
+        "arguments",
+        nargs=argparse.REMAINDER,
+        help="build arguments (the project path followed by build options, except --build)",
+    )
+    resize_parser = subparsers.add_parser(
+        "resize",
+        help="change the number of CPUs and the memory of each Virtual Machine (they are shut down and restarted)",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    resize_parser.add_argument(
+        "--os", default=".*", help="operating system regex, case insensitive"
+    )
+    resize_parser.add_argument(
+        "--build", default=str(dirname.parent / "build"), help="build directory"
+    )
+    resize_parser.add_argument(
+        "--cpus",
+        type=int,
+        default=None,
+        help="number of virtual CPUs of each Virtual Machine, defaults to half of the host's CPUs (at least 2)",
+    )
+    resize_parser.add_argument(
+        "--memory",
+        type=int,
+        default=None,
+        help="memory of each Virtual Machine in MB, defaults to the host's memory divided by the number of operating systems plus one (between 2048 and 16384)",
+    )
+    idle_parser = subparsers.add_parser(
+        "idle",
+        help="suspend the Virtual Machines that have not been used for their build --idle-suspend delay, run in the background by build",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    idle_parser.add_argument(
+        "--build", default=str(dirname.parent / "build"), help="build directory"
+    )
+    snapshot_parser = subparsers.add_parser(
+        "snapshot",
+        help="replace the snapshot restored by build --reset snapshot with the current state of each Virtual Machine",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    snapshot_parser.add_argument(
+        "--os", default=".*", help="operating system regex, case insensitive"
+    )
+    snapshot_parser.add_argument(
+        "--build", default=str(dirname.parent / "build"), help="build directory"
+    )
+    cache_parser = subparsers.add_parser(
+        "cache",
+        help="report the size of the host cache and the guest build caches",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    cache_parser.add_argument(
+        "--os", default=".*", help="operating system regex, case insensitive"
+    )
+    cache_parser.add_argument(
+        "--prune", action="store_true", help="delete the caches after reporting them"
+    )
+    cache_parser.add_argument(
+        "--cache",
+        default=str(dirname.parent / "cache"),
+        help="wheels and frozen packages cache directory",
+    )
+    cache_parser.add_argument(
+        "--build", default=str(dirname.parent / "build"), help="build directory"
+    )
+    wheelhouse_parser = subparsers.add_parser(
+        "wheelhouse",
+        help="manage the wheelhouse of build dependencies in each guest",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    wheelhouse_subparsers = wheelhouse_parser.add_subparsers(
+        dest="wheelhouse_command", required=True
+    )
+    wheelhouse_refresh_parser = wheelhouse_subparsers.add_parser(
+        "refresh",
+        help="download the build dependencies again into each guest's wheelhouse",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    wheelhouse_refresh_parser.add_argument(
+        "--os", default=".*", help="operating system regex, case insensitive"
+    )
+    wheelhouse_refresh_parser.add_argument(
+        "--build", default=str(dirname.parent / "build"), help="build directory"
+    )
+    wheelhouse_refresh_parser.add_argument(
+        "--requirements",
+        default=None,
+        help="requirements file (one requirement per line) of the build dependencies, defaults to the requirements of the previous refresh",
+    )
+    image_parser = subparsers.add_parser(
+        "image",
+        help="export or import the manylinux image archive used by the Linux provisioning",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    image_subparsers = image_parser.add_subparsers(dest="image_command", required=True)
+    image_export_parser = image_subparsers.add_parser(
+        "export",
+        help="copy the image archive that matches the current Dockerfile to a file or directory, the archive is saved from the Linux guest if the cache does not have it",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    image_export_parser.add_argument("path", help="destination file or directory")
+    image_export_parser.add_argument(
+        "--image-cache",
+        default=str(dirname.parent / "cache-images"),
+        help="directory of the manylinux image archives",
+    )
+    image_export_parser.add_argument(
+        "--build", default=str(dirname.parent / "build"), help="build directory"
+    )
+    image_import_parser = image_subparsers.add_parser(
+        "import",
+        help="copy an archive created by image export on another host into the image cache",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    image_import_parser.add_argument(
+        "archive", help="archive file (manylinux-[key].tar.gz)"
+    )
+    image_import_parser.add_argument(
+        "--image-cache",
+        default=str(dirname.parent / "cache-images"),
+        help="directory of the manylinux image archives",
+    )
     unprovision_parser = subparsers.add_parser(
         "unprovision",
         help="destroy the Vagrant machines created by Cubuzoa",
@@ -100,6 +409,7 @@ if __name__ == "__main__":
         (dirname / "vagrant_private_key").chmod(0o600)
         pathlib.Path(args.build).mkdir(exist_ok=True)
         args.os = re.compile(args.os, re.IGNORECASE)
+        os_names: list[str] = []
         for os_name in sorted(
             child.stem for child in (dirname / "provision").iterdir() if child.is_file()
         ):
@@ -108,79 +418,269 @@ if __name__ == "__main__":
                 if hasattr(os_module, "os_provision") and (
                     not (pathlib.Path(args.build) / os_name).exists() or args.force
                 ):
-                    os_module.os_provision(build=pathlib.Path(args.build) / os_name)  # type: ignore
+                    os_names.append(os_name)
+        machine_slots = threading.BoundedSemaphore(max(1, args.max_vms))
+        wheelhouse_requirements = common.read_wheelhouse_requirements(
+            None if args.wheelhouse is None else pathlib.Path(args.wheelhouse)
+        )
+        tasks: list[tuple[str, typing.Callable[[], None]]] = []
+        logs: dict[str, pathlib.Path] = {}
+        for os_name in os_names:
+            (pathlib.Path(args.build) / os_name).mkdir(exist_ok=True)
+            logs[os_name] = pathlib.Path(args.build) / os_name / "provision.log"
+            common.write_resources(
+                pathlib.Path(args.build) / os_name,
+                common.machine_resources(args.cpus, args.memory),
+            )
+            common.print_info(f"Provisioning {os_name}, see {logs[os_name]}")
+            tasks.append(
+                (
+                    os_name,
+                    functools.partial(
+                        common.run_os_provision,
+                        os_name=os_name,
+                        build=pathlib.Path(args.build) / os_name,
+                        os_provision=functools.partial(
+                            importlib.import_module(
+                                f"cubuzoa.provision.{os_name}"
+                            ).os_provision,  # type: ignore
+                            build=pathlib.Path(args.build) / os_name,
+                            **(
+                                {
+                                    "image_cache": None
+                                    if args.no_image_cache
+                                    else pathlib.Path(args.image_cache)
+                                }
+                                if os_name == "linux"
+                                else {}
+                            ),
+                        ),
+                        machine_slots=machine_slots,
+                        suspend=args.max_vms < len(os_names),
+                        wheelhouse_requirements=wheelhouse_requirements,
+                    ),
+                )
+            )
+        begin = time.monotonic()
+        outcomes = common.run_tasks(tasks, jobs=args.jobs, logs=logs)
+        common.print_summary(outcomes, time.monotonic() - begin)
+        if not all(outcome.succeeded() for outcome in outcomes):
+            sys.exit(1)
 
     if args.command == "build":
-        args.project = pathlib.Path(args.project).resolve()
-        if args.pre is not None:
-            args.pre = pathlib.Path(args.pre).resolve()
-            try:
-                args.pre = args.pre.relative_to(args.project)
-            except ValueError:
-                common.print_error(
-                    f'the pre script "{args.pre}" must be in the project directory "{args.project}"'
-                )
-                sys.exit(1)
-        if args.post is not None:
-            args.post = pathlib.Path(args.post).resolve()
-            try:
-                args.post = args.post.relative_to(args.project)
-            except ValueError:
-                common.print_error(
-                    f'the post script "{args.post}" must be in the project directory "{args.project}"'
-                )
-                sys.exit(1)
+        trace_path: typing.Optional[pathlib.Path] = None
+        if args.trace is not None:
+            trace_path = pathlib.Path(args.trace)
+            common.start_trace()
         if not pathlib.Path(args.build).is_dir():
             common.print_error(f"run python3 cubuzoa.py provision first")
             sys.exit(1)
-        with open(args.project / "pyproject.toml") as pyproject_file:
-            pyproject = toml.load(pyproject_file)
-        backend = pyproject["build-system"]["build-backend"]
-        if backend == "setuptools.build_meta":
-            backend = "setuptools"
-        backends = set(
-            child.name for child in (dirname / "backend").iterdir() if child.is_dir()
-        )
-        if not backend in backends:
-            raise Exception(
-                f'unsupported backend "{backend}" (supported backends: {backends})'
+        entries: list[dict[str, typing.Any]] = [
+            {"path": pathlib.Path(project).resolve(), "pre": None, "post": None}
+            for project in args.project
+        ]
+        if args.manifest is not None:
+            manifest_path = pathlib.Path(args.manifest).resolve()
+            with open(manifest_path) as manifest_file:
+                manifest = toml.load(manifest_file)
+            for entry in manifest.get("project", []):
+                entries.append(
+                    {
+                        "path": (manifest_path.parent / entry["path"]).resolve(),
+                        "pre": entry.get("pre"),
+                        "post": entry.get("post"),
+                        "output": (
+                            (manifest_path.parent / entry["output"]).resolve()
+                            if "output" in entry
+                            else None
+                        ),
+                    }
+                )
+        if len(entries) == 0:
+            common.print_error("build requires a project path or a manifest")
+            sys.exit(1)
+        if len(entries) > 1 and (args.pre is not None or args.post is not None):
+            common.print_error(
+                "--pre and --post require a single project, use a manifest to set scripts per project"
             )
-        if args.output is None:
-            if backend == "pyinstaller":
-                args.output = args.project / "build"
-            else:
-                args.output = args.project / "wheels"
-        else:
-            args.output = pathlib.Path(args.output).resolve()
-        args.output.mkdir(exist_ok=True)
+            sys.exit(1)
+        if len(set(entry["path"].name for entry in entries)) < len(entries):
+            common.print_error("the project directories must have different names")
+            sys.exit(1)
+        for entry in entries:
+            if len(entries) == 1:
+                for script in ("pre", "post"):
+                    if getattr(args, script) is not None:
+                        entry[script] = pathlib.Path(getattr(args, script)).resolve()
+            for script in ("pre", "post"):
+                if entry[script] is not None:
+                    script_path = (entry["path"] / entry[script]).resolve()
+                    try:
+                        entry[script] = script_path.relative_to(entry["path"])
+                    except ValueError:
+                        common.print_error(
+                            f'the {script} script "{script_path}" must be in the project directory "{entry["path"]}"'
+                        )
+                        sys.exit(1)
+            if entry.get("output") is None and args.output is not None:
+                entry["output"] = pathlib.Path(args.output).resolve()
+                if len(entries) > 1:
+                    entry["output"] /= entry["path"].name
         args.os = re.compile(args.os, re.IGNORECASE)
         versions = packaging.specifiers.SpecifierSet(args.version)
-        for os_name in sorted(
-            child.stem
-            for child in (dirname / "backend" / backend).iterdir()
-            if child.is_file() and child.suffix == ".py"
-        ):
-            if args.os.match(os_name) is not None:
-                os_module = importlib.import_module(
-                    f"cubuzoa.backend.{backend}.{os_name}"
+        backends = set(
+            child.name for child in (dirname / "backend").iterdir() if child.is_dir()
+        )
+        os_to_builds: dict[
+            str, list[tuple[str, common.Matrix, typing.Callable[[], None]]]
+        ] = {}
+        for entry in entries:
+            project: pathlib.Path = entry["path"]
+            with open(project / "pyproject.toml") as pyproject_file:
+                pyproject = toml.load(pyproject_file)
+            backend = pyproject["build-system"]["build-backend"]
+            if backend == "setuptools.build_meta":
+                backend = "setuptools"
+            if not backend in backends:
+                raise Exception(
+                    f'unsupported backend "{backend}" (supported backends: {backends})'
                 )
-                if hasattr(os_module, "os_build"):
-                    (pathlib.Path(args.build) / os_name).mkdir(exist_ok=True)
-                    os_module.os_build(  # type: ignore
-                        versions=tuple(
+            output: pathlib.Path
+            if entry.get("output") is not None:
+                output = entry["output"]
+            elif backend == "pyinstaller":
+                output = project / "build"
+            else:
+                output = project / "wheels"
+            output.mkdir(parents=True, exist_ok=True)
+            if args.no_cache:
+                cache_key = {}
+            else:
+                common.print_info(f"Hashing {project}")
+                with common.traced("hash", "phase", project=project.name):
+                    project_hash = common.project_hash(project)
+                cache_key = {
+                    "project": project_hash,
+                    "backend": backend,
+                    "requires": pyproject["build-system"].get("requires", []),
+                    "pre": None if entry["pre"] is None else entry["pre"].as_posix(),
+                    "post": None if entry["post"] is None else entry["post"].as_posix(),
+                }
+            matrix = common.Matrix()
+            for os_name in sorted(
+                child.stem
+                for child in (dirname / "backend" / backend).iterdir()
+                if child.is_file() and child.suffix == ".py"
+            ):
+                if args.os.match(os_name) is not None:
+                    os_module = importlib.import_module(
+                        f"cubuzoa.backend.{backend}.{os_name}"
+                    )
+                    if hasattr(os_module, "os_build"):
+                        if matrix.pure:
+                            common.print_info(
+                                f"Skipping {project.name} on {os_name}, a pure Python wheel has already been built"
+                            )
+                            continue
+                        (pathlib.Path(args.build) / os_name).mkdir(exist_ok=True)
+                        cache = common.Cache(
+                            directory=(
+                                None if args.no_cache else pathlib.Path(args.cache)
+                            ),
+                            size=round(args.cache_size * 1e9),
+                            os_name=os_name,
+                            key=cache_key,
+                        )
+                        os_versions = tuple(
                             version
                             for version in common.os_to_configuration[
                                 os_name
                             ].versions()
                             if versions.contains(version)
-                        ),
-                        project=args.project,
-                        output=args.output,
-                        build=pathlib.Path(args.build) / os_name,
-                        pre=args.pre,
-                        post=args.post,
-                        pyproject=pyproject,
-                    )
+                        )
+                        if (args.abi3 or args.pure) and len(os_versions) > 1:
+                            os_versions = (
+                                min(os_versions, key=packaging.version.Version),
+                            )
+                        cached_versions: list[str] = []
+                        for version in os_versions:
+                            artifacts = cache.restore(version, output)
+                            if artifacts is not None:
+                                cached_versions.append(version)
+                                matrix.update(os_name, common.wheel_coverage(artifacts))
+                        if len(cached_versions) > 0:
+                            common.print_info(
+                                f"Restored Python {common.versions_to_string(cached_versions)} of {project.name} on {os_name} from the cache"
+                            )
+                        if len(cached_versions) < len(os_versions) and not matrix.skip(
+                            os_name
+                        ):
+                            os_to_builds.setdefault(os_name, []).append(
+                                (
+                                    project.name,
+                                    matrix,
+                                    functools.partial(
+                                        os_module.os_build,  # type: ignore
+                                        versions=tuple(
+                                            version
+                                            for version in os_versions
+                                            if not version in cached_versions
+                                        ),
+                                        project=project,
+                                        output=output,
+                                        build=pathlib.Path(args.build) / os_name,
+                                        pre=entry["pre"],
+                                        post=entry["post"],
+                                        pyproject=pyproject,
+                                        jobs=getattr(args, f"{os_name}_jobs", 1),
+                                        cache=cache,
+                                        incremental=args.incremental,
+                                        upload=common.Upload(
+                                            method=args.upload,
+                                            compression=args.upload_compression,
+                                        ),
+                                        compiler_cache=(
+                                            args.compiler_cache_size
+                                            if args.compiler_cache
+                                            else None
+                                        ),
+                                        matrix=matrix,
+                                    ),
+                                )
+                            )
+                        if args.pure and len(os_versions) > 0:
+                            break
+        tasks: list[tuple[str, typing.Callable[[], None]]] = [
+            (
+                os_name,
+                functools.partial(
+                    common.run_os_build,
+                    os_name=os_name,
+                    build=pathlib.Path(args.build) / os_name,
+                    builds=builds,
+                    reset=args.reset,
+                    suspend=args.suspend_after,
+                    idle_ttl=(
+                        None if args.idle_suspend is None else args.idle_suspend * 60.0
+                    ),
+                ),
+            )
+            for os_name, builds in sorted(os_to_builds.items())
+        ]
+        if args.idle_suspend is not None and len(tasks) > 0:
+            for os_name, _ in tasks:
+                common.mark_used(
+                    pathlib.Path(args.build) / os_name, args.idle_suspend * 60.0
+                )
+            common.start_idle_watcher(pathlib.Path(args.build))
+        begin = time.monotonic()
+        outcomes = common.run_tasks(tasks, jobs=args.jobs)
+        common.print_summary(outcomes, time.monotonic() - begin)
+        if common.trace is not None and trace_path is not None:
+            common.trace.write(trace_path)
+            common.print_info(f"Wrote the trace to {trace_path}")
+        if not all(outcome.succeeded() for outcome in outcomes):
+            sys.exit(1)
 
     if args.command in {"suspend", "resume", "halt", "up"}:
         args.os = re.compile(args.os, re.IGNORECASE)
@@ -190,6 +690,175 @@ if __name__ == "__main__":
             if args.os.match(directory.name) is not None:
                 getattr(common, f"vagrant_{args.command}")(directory)
 
+    if args.command == "serve":
+        from . import server
+
+        if not pathlib.Path(args.build).is_dir():
+            common.print_error(f"run python3 cubuzoa.py provision first")
+            sys.exit(1)
+        server.serve(
+            socket_path=(
+                pathlib.Path(args.build) / "serve.sock"
+                if args.socket is None
+                else pathlib.Path(args.socket)
+            ),
+            build=pathlib.Path(args.build).resolve(),
+            jobs=args.jobs,
+            parse_build_arguments=build_parser.parse_args,
+        )
+
+    if args.command == "submit":
+        if args.arguments[:1] == ["--"]:
+            args.arguments = args.arguments[1:]
+        build_parser.parse_args(args.arguments)
+        from . import server
+
+        sys.exit(server.submit(pathlib.Path(str(args.socket)), args.arguments))
+
+    if args.command == "idle":
+        common.suspend_idle(pathlib.Path(args.build).resolve())
+
+    if args.command == "resize":
+        args.os = re.compile(args.os, re.IGNORECASE)
+        resources = common.machine_resources(args.cpus, args.memory)
+        for directory in sorted(
+            child for child in pathlib.Path(args.build).iterdir() if child.is_dir()
+        ):
+            if args.os.match(directory.name) is not None and common.provisioned(
+                directory
+            ):
+                common.print_info(f"Resizing {directory.name}")
+                common.resize_machine(directory, resources)
+
+    if args.command == "snapshot":
+        args.os = re.compile(args.os, re.IGNORECASE)
+        for directory in sorted(
+            child for child in pathlib.Path(args.build).iterdir() if child.is_dir()
+        ):
+            if (
+                args.os.match(directory.name) is not None
+                and (
+                    directory
+                    / ".vagrant"
+                    / "machines"
+                    / "default"
+                    / "virtualbox"
+                    / "id"
+                ).is_file()
+            ):
+                common.take_snapshot(directory)
+
+    if args.command == "cache":
+        cache_directory = pathlib.Path(args.cache)
+        if cache_directory.is_dir():
+            common.print_info(
+                "host {}: {}".format(
+                    cache_directory,
+                    common.format_size(
+                        sum(
+                            path.lstat().st_size
+                            for path in cache_directory.rglob("*")
+                            if path.is_file() or path.is_symlink()
+                        )
+                    ),
+                )
+            )
+            if args.prune:
+                shutil.rmtree(cache_directory)
+        args.os = re.compile(args.os, re.IGNORECASE)
+        if pathlib.Path(args.build).is_dir():
+            for directory in sorted(
+                child for child in pathlib.Path(args.build).iterdir() if child.is_dir()
+            ):
+                if (
+                    directory.name in common.os_to_configuration
+                    and args.os.match(directory.name) is not None
+                ):
+                    try:
+                        name_to_size = common.guest_caches(
+                            directory, directory.name, prune=args.prune
+                        )
+                    except subprocess.CalledProcessError:
+                        common.print_warning(
+                            f"the {directory.name} guest is not running, run python3 -m cubuzoa up first"
+                        )
+                        continue
+                    for name, size in name_to_size.items():
+                        common.print_info(
+                            f"{directory.name} {name}: {common.format_size(size)}"
+                        )
+                    if args.prune:
+                        (directory / "wheelhouse.json").unlink(missing_ok=True)
+
+    if args.command == "wheelhouse" and args.wheelhouse_command == "refresh":
+        args.os = re.compile(args.os, re.IGNORECASE)
+        for directory in sorted(
+            child for child in pathlib.Path(args.build).iterdir() if child.is_dir()
+        ):
+            if (
+                directory.name in common.os_to_configuration
+                and args.os.match(directory.name) is not None
+                and common.provisioned(directory)
+            ):
+                if args.requirements is None:
+                    requirements = common.wheelhouse_requirements(directory)
+                    if requirements is None:
+                        requirements = common.read_wheelhouse_requirements(None)
+                else:
+                    requirements = common.read_wheelhouse_requirements(
+                        pathlib.Path(args.requirements)
+                    )
+                with common.guest_lock(directory):
+                    common.wake_guest(directory)
+                    common.refresh_wheelhouse(directory, directory.name, requirements)
+                    if common.has_snapshot(directory):
+                        common.take_snapshot(directory)
+
+    if args.command == "image":
+        linux_provision = importlib.import_module("cubuzoa.provision.linux")
+        image_key = linux_provision.image_key()  # type: ignore
+        archive = common.image_archive(pathlib.Path(args.image_cache), image_key)
+        if args.image_command == "export":
+            if not archive.is_file():
+                linux_build = pathlib.Path(args.build) / "linux"
+                if not common.provisioned(linux_build):
+                    common.print_error(
+                        f"{archive} does not exist and Linux is not provisioned, run python3 -m cubuzoa provision --os linux first"
+                    )
+                    sys.exit(1)
+                with open(linux_build / "Dockerfile") as dockerfile_file:
+                    if dockerfile_file.read() != linux_provision.dockerfile():  # type: ignore
+                        common.print_error(
+                            "the Linux guest was provisioned with another Dockerfile, run python3 -m cubuzoa provision --os linux --force first"
+                        )
+                        sys.exit(1)
+                with common.guest_lock(linux_build):
+                    common.wake_guest(linux_build)
+                    common.save_linux_image(linux_build, archive)
+            destination = pathlib.Path(args.path)
+            if destination.is_dir():
+                destination = destination / archive.name
+            common.print_info(f"Exporting {archive} to {destination}")
+            shutil.copyfile(archive, destination)
+        if args.image_command == "import":
+            source = pathlib.Path(args.archive)
+            match = re.match(r"^manylinux-([0-9a-f]{16})\.tar\.gz$", source.name)
+            if match is None:
+                common.print_error(
+                    f'"{source.name}" is not an image archive name (manylinux-[key].tar.gz)'
+                )
+                sys.exit(1)
+            if match.group(1) != image_key:
+                common.print_warning(
+                    f"{source.name} was built from another Dockerfile (the current key is {image_key}), provisioning will not use it"
+                )
+            destination = pathlib.Path(args.image_cache) / source.name
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            common.print_info(f"Importing {source} to {destination}")
+            partial_destination = destination.parent / f".{destination.name}.partial"
+            shutil.copyfile(source, partial_destination)
+            partial_destination.rename(destination)
+
     if args.command == "unprovision":
         if pathlib.Path(args.build).is_dir():
             for directory in sorted(
@@ -0,0 +1,122 @@
+import base64
+import concurrent.futures
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import typing
+import zlib
+
+marker = "cubuzoa-agent:"
+output_lock = threading.Lock()
+
+
+def emit(line: str) -> None:
+    with output_lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+
+def emit_event(event: str, step: str, **fields: typing.Any) -> None:
+    emit(marker + json.dumps(dict(event=event, step=step, **fields)))
+
+
+def run_step(
+    job: dict[str, typing.Any], step: dict[str, typing.Any], prefix: str
+) -> int:
+    environment = dict(os.environ)
+    environment.update(job.get("env", {}))
+    environment.update(step.get("env", {}))
+    cwd = os.path.join(job.get("cwd", "."), step.get("cwd", "."))
+    command: typing.Union[str, list[str]] = step["command"]
+    if isinstance(command, str) and job.get("shell") is not None:
+        command = job["shell"] + [command]
+    emit_event("start", step["name"])
+    begin = time.monotonic()
+    try:
+        process = subprocess.Popen(
+            command,
+            shell=isinstance(command, str),
+            cwd=cwd,
+            env=environment,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+    except OSError as error:
+        emit(f"{prefix}{error}")
+        returncode = 127
+    else:
+        assert process.stdout is not None
+        for line in process.stdout:
+            emit(
+                prefix
+                + line.decode("utf-8", errors="replace").rstrip("\r\n").split("\r")[-1]
+            )
+        returncode = process.wait()
+    emit_event(
+        "end",
+        step["name"],
+        returncode=returncode,
+        duration=time.monotonic() - begin,
+    )
+    return returncode
+
+
+def run_job(job: dict[str, typing.Any]) -> int:
+    steps: list[dict[str, typing.Any]] = job["steps"]
+    jobs: int = max(1, job.get("jobs", 1))
+    for index, step in enumerate(steps):
+        if "needs" not in step:
+            step["needs"] = [] if index == 0 else [steps[index - 1]["name"]]
+    name_to_returncode: dict[str, int] = {}
+    pending = list(steps)
+    future_to_step: dict[concurrent.futures.Future[int], dict[str, typing.Any]] = {}
+    failed = False
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        while len(pending) > 0 or len(future_to_step) > 0:
+            for step in list(pending):
+                if failed:
+                    pending.remove(step)
+                    emit_event("skip", step["name"])
+                elif (
+                    all(name_to_returncode.get(name) == 0 for name in step["needs"])
+                    and len(future_to_step) < jobs
+                ):
+                    pending.remove(step)
+                    future_to_step[
+                        executor.submit(
+                            run_step,
+                            job,
+                            step,
+                            "" if jobs == 1 else "[{}] ".format(step["name"]),
+                        )
+                    ] = step
+            if len(future_to_step) == 0:
+                if len(pending) > 0:
+                    for step in pending:
+                        emit_event("skip", step["name"])
+                    failed = True
+                break
+            done, _ = concurrent.futures.wait(
+                future_to_step, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                step = future_to_step.pop(future)
+                name_to_returncode[step["name"]] = future.result()
+                if name_to_returncode[step["name"]] != 0:
+                    failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    if isinstance(sys.stdout, io.TextIOWrapper):
+        sys.stdout.reconfigure(encoding="utf-8", errors="replace")
+    sys.exit(
+        run_job(
+            json.loads(zlib.decompress(base64.b64decode(sys.argv[1])).decode("utf-8"))
+        )
+    )
@@ -11,79 +11,108 @@ def os_build(
     pre: pathlib.Path,
     post: pathlib.Path,
     pyproject: dict[str, typing.Any],
+    jobs: int,
+    cache: common.Cache,
+    incremental: bool,
+    upload: common.Upload,
+    compiler_cache: typing.Optional[float],
+    matrix: common.Matrix,
 ):
     common.print_info(f"Copying project files to macOS")
-    common.vagrant_run(build, "rm -rf project; rm -rf wheels; mkdir wheels")
-    common.rsync(build, host_path=project, guest_path="project", host_to_guest=True)
-    for version in versions:
-        python_version = common.os_to_configuration["macos"].version_to_name[version]
+    common.vagrant_run(build, "rm -rf wheels; mkdir wheels")
+    guest_project = common.upload_project(build, project, "macos", incremental, upload)
+    harvester = common.Harvester(build, "macos", output, cache, matrix, versions)
+    version_to_workspace = common.unix_workspaces(
+        build, "macos", guest_project, versions, jobs, incremental
+    )
+
+    def build_version(version: str) -> None:
+        if matrix.skip("macos"):
+            return
+        python = common.macos_python(version)
+        workspace = version_to_workspace[version]
+        home = common.workspace_home("macos", workspace)
+        new_wheels = f"{home}new-wheels/{version}"
         common.print_info(f"Building for Python {version} on macOS")
-        common.vagrant_run(
+        common.agent_run(
             build,
-            " && ".join(
-                (
-                    "rm -rf new-wheels",
-                    "mkdir new-wheels",
-                    "cd project",
-                    *(
-                        ()
-                        if pre is None
-                        else (
-                            "printf '{}\n'".format(
-                                common.format_info(f"Running {pre.as_posix()}")
-                            ),
-                            "/usr/local/bin/pyenv exec python3 {}".format(
-                                pre.as_posix()
-                            ),
-                        )
-                    ),
-                    " ".join(
-                        (
-                            "/Users/vagrant/.pyenv/versions/{}/bin/maturin".format(
-                                common.os_to_configuration["macos"].default_name()
-                            ),
-                            "build",
-                            "--interpreter",
-                            f"/Users/vagrant/.pyenv/versions/{python_version}/bin/python3",
-                            "--release",
-                            "--strip",
-                            "--out",
-                            "../new-wheels",
-                        )
-                    ),
-                    f"/usr/local/bin/pyenv local {python_version}",
-                    *(
-                        ()
-                        if post is None
-                        else (
+            "macos",
+            (
+                common.Step("prepare", f"rm -rf {new_wheels} && mkdir -p {new_wheels}"),
+                *(
+                    ()
+                    if pre is None
+                    else (
+                        common.Step(
+                            "pre",
+                            f"{python} {pre.as_posix()}",
+                            description=f"Running {pre.as_posix()}",
+                        ),
+                    )
+                ),
+                common.Step(
+                    "maturin",
+                    [
+                        "/Users/vagrant/.pyenv/versions/{}/bin/maturin".format(
+                            common.os_to_configuration["macos"].default_name()
+                        ),
+                        "build",
+                        "--interpreter",
+                        python,
+                        "--release",
+                        "--strip",
+                        "--out",
+                        new_wheels,
+                    ],
+                ),
+                *(
+                    ()
+                    if post is None
+                    else (
+                        common.Step(
+                            "install",
                             ";".join(
                                 (
-                                    "for wheel in ../new-wheels/*.whl",
-                                    "    do /usr/local/bin/pyenv exec python3 {}".format(
-                                        common.pip_install("$wheel")
-                                    ),
+                                    f"for wheel in {new_wheels}/*.whl",
+                                    f"    do {python} {common.pip_install('$wheel')}",
                                     "done",
                                 )
                             ),
-                            "printf '{}\n'".format(
-                                common.format_info(f"Running {post.as_posix()}")
-                            ),
-                            "/usr/local/bin/pyenv exec python3 {}".format(
-                                post.as_posix()
-                            ),
+                        ),
+                        common.Step(
+                            "post",
+                            f"{python} {post.as_posix()}",
+                            description=f"Running {post.as_posix()}",
+                        ),
+                        common.Step(
+                            "uninstall",
                             ";".join(
                                 (
-                                    "for wheel in ../new-wheels/*.whl",
-                                    "    do /usr/local/bin/pyenv exec python3 {}".format(
-                                        common.pip_uninstall("$wheel")
-                                    ),
+                                    f"for wheel in {new_wheels}/*.whl",
+                                    f"    do {python} {common.pip_uninstall('$wheel')}",
                                     "done",
                                 )
                             ),
-                        )
-                    ),
-                    "mv ../new-wheels/* ../wheels/",
-                )
+                        ),
+                    )
+                ),
+                common.Step(
+                    "collect",
+                    f"mkdir -p {home}wheels/{version} && mv {new_wheels}/* {home}wheels/{version}/",
+                ),
             ),
+            cwd=workspace,
+            environment=common.maturin_environment(
+                "macos",
+                project,
+                "x86_64-apple-darwin",
+                version if jobs > 1 else None,
+                compiler_cache,
+            ),
+            concurrency=common.concurrent_targets("macos", versions, jobs),
+            name=f"Python {version}",
         )
-        common.rsync(build, host_path=output, guest_path="wheels/", host_to_guest=False)
+        harvester.harvest(f"wheels/{version}", version)
+
+    with harvester:
+        common.run_versions(build_version, versions, jobs)
@@ -11,89 +11,124 @@ def os_build(
     pre: pathlib.Path,
     post: pathlib.Path,
     pyproject: dict[str, typing.Any],
+    jobs: int,
+    cache: common.Cache,
+    incremental: bool,
+    upload: common.Upload,
+    compiler_cache: typing.Optional[float],
+    matrix: common.Matrix,
 ):
     common.print_info(f"Copying project files to Windows")
-    common.rsync_windows_utilities(build)
     common.vagrant_run(
-        build, "rmdir /s /q project 2>nul & rmdir /s /q wheels 2>nul & mkdir wheels"
+        build,
+        " & ".join(
+            (
+                "rmdir /s /q wheels 2>nul",
+                "mkdir wheels",
+                *(f"mkdir wheels\\{version}" for version in versions),
+            )
+        ),
+    )
+    guest_project = common.upload_project(
+        build, project, "windows", incremental, upload
     )
-    common.rsync(build, host_path=project, guest_path="project", host_to_guest=True)
+    harvester = common.Harvester(build, "windows", output, cache, matrix, versions)
     maturin = '"C:\\Program Files\\Python{}\\Scripts\\maturin.exe"'.format(
         common.os_to_configuration["windows"].default_version().replace(".", "")
     )
-    for version in versions:
-        for version_string, python, target in (
+    target_to_workspace = common.windows_workspaces(
+        build, guest_project, versions, jobs, incremental
+    )
+
+    def build_target(version: str, architecture: str) -> None:
+        version_string = common.windows_version_string(version, architecture)
+        python = common.windows_python(version, architecture)
+        target = common.windows_architecture_to_rust_target[architecture]
+        workspace = target_to_workspace[(version, architecture)]
+        home = common.workspace_home("windows", workspace)
+        new_wheels = f"{home}new-wheels\\{version}-{architecture}"
+        common.print_info(f"Building for Python {version_string} on Windows")
+        common.agent_run(
+            build,
+            "windows",
             (
-                version,
-                '"C:\\Program Files\\Python{}\\python.exe"'.format(
-                    version.replace(".", "")
+                common.Step(
+                    "prepare",
+                    f"rmdir /s /q {new_wheels} 2>nul & rmdir /s /q {new_wheels} 2>nul & mkdir {new_wheels}",
                 ),
-                "x86_64-pc-windows-msvc",
-            ),
-            (
-                f"{version} (32 bits)",
-                '"C:\\Program Files (x86)\\Python{}-32\\python.exe"'.format(
-                    version.replace(".", "")
+                *(
+                    ()
+                    if pre is None
+                    else (
+                        common.Step(
+                            "pre",
+                            f"{python} {pre.as_posix()}",
+                            description=f"Running {pre.as_posix()}",
+                        ),
+                    )
                 ),
-                "i686-pc-windows-msvc",
-            ),
-        ):
-            common.print_info(f"Building for Python {version_string} on Windows")
-            common.vagrant_run(
-                build,
-                "rmdir /s /q new-wheels 2>nul & rmdir /s /q new-wheels 2>nul & mkdir new-wheels",
-            )
-            common.vagrant_run(
-                build,
-                " && ".join(
-                    (
-                        "echo off",
-                        "rmdir /s /q new-wheels 2>nul & rmdir /s /q new-wheels 2>nul & mkdir new-wheels",
-                        "cd project",
-                        *(
-                            ()
-                            if pre is None
-                            else (
-                                "{} ..\\utilities\\echo.py {}".format(
-                                    python, f"Running {pre.as_posix()}"
-                                ),
-                                "{} {}".format(python, pre.as_posix()),
-                            )
+                common.Step(
+                    "maturin",
+                    " ".join(
+                        (
+                            maturin,
+                            "build",
+                            "--interpreter",
+                            python,
+                            "--release",
+                            "--strip",
+                            "--target",
+                            target,
+                            "--out",
+                            new_wheels,
+                        )
+                    ),
+                ),
+                *(
+                    ()
+                    if post is None
+                    else (
+                        common.Step(
+                            "install",
+                            "for %w in ({}\\*.whl) do {} {}".format(
+                                new_wheels, python, common.pip_install("%w")
+                            ),
                         ),
-                        " ".join(
-                            (
-                                maturin,
-                                "build",
-                                "--interpreter",
-                                python,
-                                "--release",
-                                "--strip",
-                                "--target",
-                                target,
-                                "--out",
-                                "..\\new-wheels",
-                            )
+                        common.Step(
+                            "post",
+                            f"{python} {post.as_posix()}",
+                            description=f"Running {post.as_posix()}",
                         ),
-                        *(
-                            ()
-                            if post is None
-                            else (
-                                "for %w in (..\\new-wheels\\*.whl) do {} {}".format(
-                                    python, common.pip_install("%w")
-                                ),
-                                "{} ..\\utilities\\echo.py {}".format(
-                                    python, f"Running {post.as_posix()}"
-                                ),
-                                "{} {}".format(python, post.as_posix()),
-                                "for %w in (..\\new-wheels\\*.whl) do {} {}".format(
-                                    python, common.pip_uninstall("%w")
-                                ),
-                            )
+                        common.Step(
+                            "uninstall",
+                            "for %w in ({}\\*.whl) do {} {}".format(
+                                new_wheels, python, common.pip_uninstall("%w")
+                            ),
                         ),
-                        "move /y ..\\new-wheels\\*.whl ..\\wheels\\",
                     )
                 ),
-            )
-            common.rsync(
-                build, host_path=output, guest_path="wheels", host_to_guest=False
-            )
+                common.Step(
+                    "collect",
+                    f"move /y {new_wheels}\\*.whl {home}wheels\\{version}\\",
+                ),
+            ),
+            cwd=workspace,
+            environment=common.maturin_environment(
+                "windows",
+                project,
+                target,
+                version if jobs > 1 else None,
+                compiler_cache,
+            ),
+            concurrency=common.concurrent_targets("windows", versions, jobs),
+            name=f"Python {version_string}",
+        )
+
+    with harvester:
+        common.run_windows_targets(
+            build_target,
+            versions,
+            jobs,
+            matrix,
+            lambda version: harvester.harvest(f"wheels/{version}", version),
+        )
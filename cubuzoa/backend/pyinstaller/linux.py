@@ -11,55 +11,74 @@ def os_build(
     pre: pathlib.Path,
     post: pathlib.Path,
     pyproject: dict[str, typing.Any],
+    jobs: int,
+    cache: common.Cache,
+    incremental: bool,
+    upload: common.Upload,
+    compiler_cache: typing.Optional[float],
+    matrix: common.Matrix,
 ):
     common.print_info(f"Copying project files to Linux")
-    common.vagrant_run(build, "sudo rm -rf project; sudo rm -rf build; mkdir build")
-    common.rsync(build, host_path=project, guest_path="project", host_to_guest=True)
+    common.vagrant_run(build, "sudo rm -rf build; mkdir build")
+    guest_project = common.upload_project(build, project, "linux", incremental, upload)
+    harvester = common.Harvester(build, "linux", output, cache, matrix, versions)
     if len(versions) > 1 or len(versions) == 1 and versions[0] != "3.8":
         common.print_warning(
             "Only Python 3.8 is supported by PyInstaller on Linux (see https://github.com/pypa/manylinux/issues/1149)"
         )
-    if len(versions) >= 1:
-        common.print_info(f"Building with Python 3.8 on Linux")
-        common.linux_docker_run(
-            build,
-            " && ".join(
+    with harvester:
+        if len(versions) >= 1:
+            common.print_info(f"Building with Python 3.8 on Linux")
+            python = "source /opt/rh/rh-python38/enable && python3"
+            common.agent_run(
+                build,
+                "linux",
                 (
                     *(
                         ()
                         if pre is None
                         else (
-                            "printf \\'{}\\n\\'".format(
-                                common.format_info(f"Running {pre.as_posix()}")
+                            common.Step(
+                                "pre",
+                                f"python3 {pre.as_posix()}",
+                                description=f"Running {pre.as_posix()}",
                             ),
-                            "python3 {}".format(pre.as_posix()),
                         )
                     ),
-                    "source /opt/rh/rh-python38/enable",
-                    "python3 {}".format(
-                        common.pip_install_pyproject(pyproject, "linux")
+                    common.Step(
+                        "requirements",
+                        f"{python} {common.pip_install_pyproject(pyproject, 'linux')}",
+                        environment=common.wheelhouse_environment(
+                            build, "linux", pyproject, "3.8"
+                        ),
                     ),
-                    "python3 {}".format(
-                        common.pyinstaller(
-                            project=project,
-                            target="/build",
-                            pyproject=pyproject,
-                            version="3.8",
-                            suffix="manylinux",
-                            guest="linux",
-                        )
+                    common.Step(
+                        "pyinstaller",
+                        "{} {}".format(
+                            python,
+                            common.pyinstaller(
+                                project=project,
+                                target="/build/3.8",
+                                pyproject=pyproject,
+                                version="3.8",
+                                suffix="manylinux",
+                                guest="linux",
+                            ),
+                        ),
                     ),
                     *(
                         ()
                         if post is None
                         else (
-                            "printf \\'{}\\n\\'".format(
-                                common.format_info(f"Running {post.as_posix()}")
+                            common.Step(
+                                "post",
+                                f"{python} {post.as_posix()}",
+                                description=f"Running {post.as_posix()}",
                             ),
-                            "python3 {}".format(post.as_posix()),
                         )
                     ),
-                )
-            ),
-        )
-        common.rsync(build, host_path=output, guest_path="build/", host_to_guest=False)
+                ),
+                project=guest_project,
+                name="Python 3.8",
+            )
+            harvester.harvest("build/3.8", "3.8", cached_versions=versions)
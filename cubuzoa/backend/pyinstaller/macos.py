@@ -11,58 +11,79 @@ def os_build(
     pre: pathlib.Path,
     post: pathlib.Path,
     pyproject: dict[str, typing.Any],
+    jobs: int,
+    cache: common.Cache,
+    incremental: bool,
+    upload: common.Upload,
+    compiler_cache: typing.Optional[float],
+    matrix: common.Matrix,
 ):
     common.print_info(f"Copying project files to macOS")
-    common.vagrant_run(build, "rm -rf project; rm -rf build; mkdir build")
-    common.rsync(build, host_path=project, guest_path="project", host_to_guest=True)
-    for version in versions:
+    common.vagrant_run(build, "rm -rf build; mkdir build")
+    guest_project = common.upload_project(build, project, "macos", incremental, upload)
+    harvester = common.Harvester(build, "macos", output, cache, matrix, versions)
+    version_to_workspace = common.unix_workspaces(
+        build, "macos", guest_project, versions, jobs, incremental
+    )
+
+    def build_version(version: str) -> None:
+        python = common.macos_python(version)
+        workspace = version_to_workspace[version]
+        home = common.workspace_home("macos", workspace)
         common.print_info(f"Building with Python {version} on macOS")
-        common.vagrant_run(
+        common.agent_run(
             build,
-            " && ".join(
-                (
-                    "cd project",
-                    *(
-                        ()
-                        if pre is None
-                        else (
-                            "printf '{}\n'".format(
-                                common.format_info(f"Running {pre.as_posix()}")
-                            ),
-                            "/usr/local/bin/pyenv exec python3 {}".format(
-                                pre.as_posix()
-                            ),
-                        )
-                    ),
-                    "/usr/local/bin/pyenv local {}".format(
-                        common.os_to_configuration["macos"].version_to_name[version]
-                    ),
-                    "/usr/local/bin/pyenv exec python3 {}".format(
-                        common.pip_install_pyproject(pyproject, "macos")
+            "macos",
+            (
+                *(
+                    ()
+                    if pre is None
+                    else (
+                        common.Step(
+                            "pre",
+                            f"{python} {pre.as_posix()}",
+                            description=f"Running {pre.as_posix()}",
+                        ),
+                    )
+                ),
+                common.Step(
+                    "requirements",
+                    common.macos_install_requirements(pyproject, version),
+                    environment=common.wheelhouse_environment(
+                        build, "macos", pyproject, version
                     ),
-                    "/usr/local/bin/pyenv exec python3 {}".format(
+                ),
+                common.Step(
+                    "pyinstaller",
+                    "{} {}".format(
+                        python,
                         common.pyinstaller(
                             project=project,
-                            target="../build",
+                            target=f"{home}build/{version}",
                             pyproject=pyproject,
                             version=version,
                             suffix="macosx",
                             guest="macos",
-                        )
+                        ),
                     ),
-                    *(
-                        ()
-                        if post is None
-                        else (
-                            "printf '{}\n'".format(
-                                common.format_info(f"Running {post.as_posix()}")
-                            ),
-                            "/usr/local/bin/pyenv exec python3 {}".format(
-                                post.as_posix()
-                            ),
-                        )
-                    ),
-                )
+                ),
+                *(
+                    ()
+                    if post is None
+                    else (
+                        common.Step(
+                            "post",
+                            f"{python} {post.as_posix()}",
+                            description=f"Running {post.as_posix()}",
+                        ),
+                    )
+                ),
             ),
+            cwd=workspace,
+            concurrency=common.concurrent_targets("macos", versions, jobs),
+            name=f"Python {version}",
         )
-        common.rsync(build, host_path=output, guest_path="build/", host_to_guest=False)
+        harvester.harvest(f"build/{version}", version)
+
+    with harvester:
+        common.run_versions(build_version, versions, jobs)
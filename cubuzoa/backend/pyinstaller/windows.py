@@ -11,74 +11,89 @@ def os_build(
     pre: pathlib.Path,
     post: pathlib.Path,
     pyproject: dict[str, typing.Any],
+    jobs: int,
+    cache: common.Cache,
+    incremental: bool,
+    upload: common.Upload,
+    compiler_cache: typing.Optional[float],
+    matrix: common.Matrix,
 ):
     common.print_info(f"Copying project files to Windows")
-    common.rsync_windows_utilities(build)
-    common.vagrant_run(
-        build, "rmdir /s /q project 2>nul & rmdir /s /q build 2>nul & mkdir build"
+    common.vagrant_run(build, "rmdir /s /q build 2>nul & mkdir build")
+    guest_project = common.upload_project(
+        build, project, "windows", incremental, upload
     )
-    common.rsync(build, host_path=project, guest_path="project", host_to_guest=True)
-    for version in versions:
-        for suffix, version_string, python in (
+    harvester = common.Harvester(build, "windows", output, cache, matrix, versions)
+    target_to_workspace = common.windows_workspaces(
+        build, guest_project, versions, jobs, incremental
+    )
+
+    def build_target(version: str, architecture: str) -> None:
+        version_string = common.windows_version_string(version, architecture)
+        python = common.windows_python(version, architecture)
+        workspace = target_to_workspace[(version, architecture)]
+        home = common.workspace_home("windows", workspace)
+        common.print_info(f"Building with Python {version_string} on Windows")
+        common.agent_run(
+            build,
+            "windows",
             (
-                "win",
-                version,
-                '"C:\\Program Files\\Python{}\\python.exe"'.format(
-                    version.replace(".", "")
+                *(
+                    ()
+                    if pre is None
+                    else (
+                        common.Step(
+                            "pre",
+                            f"{python} {pre.as_posix()}",
+                            description=f"Running {pre.as_posix()}",
+                        ),
+                    )
                 ),
-            ),
-            (
-                "win32",
-                f"{version} (32 bits)",
-                '"C:\\Program Files (x86)\\Python{}-32\\python.exe"'.format(
-                    version.replace(".", "")
+                common.Step(
+                    "requirements",
+                    "{} {}".format(
+                        python, common.pip_install_pyproject(pyproject, "windows")
+                    ),
+                    environment=common.wheelhouse_environment(
+                        build, "windows", pyproject, version, architecture
+                    ),
                 ),
-            ),
-        ):
-            common.print_info(f"Building with Python {version_string} on Windows")
-            common.vagrant_run(
-                build,
-                " && ".join(
-                    (
-                        "echo off",
-                        "cd project",
-                        *(
-                            ()
-                            if pre is None
-                            else (
-                                "{} ..\\utilities\\echo.py {}".format(
-                                    python, f"Running {pre.as_posix()}"
-                                ),
-                                "{} {}".format(python, pre.as_posix()),
-                            )
-                        ),
-                        "{} {}".format(
-                            python, common.pip_install_pyproject(pyproject, "windows")
-                        ),
-                        "{} {}".format(
-                            python,
-                            common.pyinstaller(
-                                project=project,
-                                target="..\\build",
-                                pyproject=pyproject,
-                                version=version,
-                                suffix=suffix,
-                                guest="windows",
-                            ),
+                common.Step(
+                    "pyinstaller",
+                    "{} {}".format(
+                        python,
+                        common.pyinstaller(
+                            project=project,
+                            target=f"{home}build\\{version}",
+                            pyproject=pyproject,
+                            version=version,
+                            suffix="win" if architecture == "x64" else "win32",
+                            guest="windows",
                         ),
-                        *(
-                            ()
-                            if post is None
-                            else (
-                                "{} ..\\utilities\\echo.py {}".format(
-                                    python, f"Running {post.as_posix()}"
-                                ),
-                                "{} {}".format(python, post.as_posix()),
-                            )
+                    ),
+                ),
+                *(
+                    ()
+                    if post is None
+                    else (
+                        common.Step(
+                            "post",
+                            f"{python} {post.as_posix()}",
+                            description=f"Running {post.as_posix()}",
                         ),
                     )
                 ),
-            )
-            common.rsync(
-                build, host_path=output, guest_path="build", host_to_guest=False
-            )
+            ),
+            cwd=workspace,
+            concurrency=common.concurrent_targets("windows", versions, jobs),
+            name=f"Python {version_string}",
+        )
+
+    with harvester:
+        common.run_windows_targets(
+            build_target,
+            versions,
+            jobs,
+            matrix,
+            lambda version: harvester.harvest(f"build/{version}", version),
+        )
@@ -11,69 +11,118 @@ def os_build(
     pre: pathlib.Path,
     post: pathlib.Path,
     pyproject: dict[str, typing.Any],
+    jobs: int,
+    cache: common.Cache,
+    incremental: bool,
+    upload: common.Upload,
+    compiler_cache: typing.Optional[float],
+    matrix: common.Matrix,
 ):
     common.print_info(f"Copying project files to Linux")
-    common.vagrant_run(build, "sudo rm -rf project; sudo rm -rf wheels; mkdir wheels")
-    common.rsync(build, host_path=project, guest_path="project", host_to_guest=True)
-    for version in versions:
+    common.vagrant_run(build, "sudo rm -rf wheels; mkdir wheels")
+    guest_project = common.upload_project(build, project, "linux", incremental, upload)
+    harvester = common.Harvester(build, "linux", output, cache, matrix, versions)
+    if compiler_cache is not None:
+        common.ccache(build, "linux", compiler_cache, "--zero-stats")
+    version_to_project = common.unix_workspaces(
+        build, "linux", guest_project, versions, jobs, incremental
+    )
+
+    def build_version(version: str) -> None:
+        if matrix.skip("linux"):
+            return
         python_path = common.os_to_configuration["linux"].version_to_name[version]
         common.print_info(f"Building for Python {version} on Linux")
-        common.linux_docker_run(
+        python = f"{python_path}/python"
+        scratch = f"/tmp/cubuzoa/{version}"
+        common.agent_run(
             build,
-            " && ".join(
-                (
-                    *(
-                        ()
-                        if pre is None
-                        else (
-                            "printf \\'{}\\n\\'".format(
-                                common.format_info(f"Running {pre.as_posix()}")
-                            ),
-                            "{}/python {}".format(python_path, pre.as_posix()),
-                        )
-                    ),
-                    "mkdir ../unaudited-wheels",
-                    "mkdir ../new-wheels",
-                    "{}/python {}".format(
-                        python_path, common.pip_wheel("/unaudited-wheels")
+            "linux",
+            (
+                *(
+                    ()
+                    if pre is None
+                    else (
+                        common.Step(
+                            "pre",
+                            f"{python} {pre.as_posix()}",
+                            description=f"Running {pre.as_posix()}",
+                        ),
+                    )
+                ),
+                common.Step(
+                    "prepare",
+                    f"rm -rf {scratch} && mkdir -p {scratch}/unaudited-wheels {scratch}/new-wheels",
+                ),
+                common.Step(
+                    "wheel",
+                    f"{python} {common.pip_wheel(f'{scratch}/unaudited-wheels')}",
+                    environment=common.wheelhouse_environment(
+                        build, "linux", pyproject, version
                     ),
+                ),
+                common.Step(
+                    "auditwheel",
                     ";".join(
                         (
-                            "for wheel in ../unaudited-wheels/*.whl",
-                            "    do auditwheel repair --plat manylinux2014_x86_64 --strip --only-plat $wheel -w ../new-wheels",
+                            f"for wheel in {scratch}/unaudited-wheels/*.whl",
+                            "    do if [[ $wheel == *-none-any.whl ]]",
+                            f"        then cp $wheel {scratch}/new-wheels",
+                            f"        else auditwheel repair --plat manylinux2014_x86_64 --strip --only-plat $wheel -w {scratch}/new-wheels",
+                            "    fi",
                             "done",
                         )
                     ),
-                    *(
-                        ()
-                        if post is None
-                        else (
+                ),
+                *(
+                    ()
+                    if post is None
+                    else (
+                        common.Step(
+                            "install",
                             ";".join(
                                 (
-                                    "for wheel in ../new-wheels/*.whl",
-                                    "    do {}/python {}".format(
-                                        python_path, common.pip_install("$wheel")
-                                    ),
+                                    f"for wheel in {scratch}/new-wheels/*.whl",
+                                    f"    do {python} {common.pip_install('$wheel')}",
                                     "done",
                                 )
                             ),
-                            "printf \\'{}\\n\\'".format(
-                                common.format_info(f"Running {post.as_posix()}")
-                            ),
-                            "{}/python {}".format(python_path, post.as_posix()),
+                        ),
+                        common.Step(
+                            "post",
+                            f"{python} {post.as_posix()}",
+                            description=f"Running {post.as_posix()}",
+                        ),
+                        common.Step(
+                            "uninstall",
                             ";".join(
                                 (
-                                    "for wheel in ../new-wheels/*.whl",
-                                    "    do {}/python {}".format(
-                                        python_path, common.pip_uninstall("$wheel")
-                                    ),
+                                    f"for wheel in {scratch}/new-wheels/*.whl",
+                                    f"    do {python} {common.pip_uninstall('$wheel')}",
                                     "done",
                                 )
                             ),
-                        )
-                    ),
-                    "mv ../new-wheels/* ../wheels/",
-                )
+                        ),
+                    )
+                ),
+                common.Step(
+                    "collect",
+                    f"mkdir -p /wheels/{version} && mv {scratch}/new-wheels/* /wheels/{version}/",
+                ),
             ),
+            environment=(
+                {}
+                if compiler_cache is None
+                else common.ccache_environment("linux", compiler_cache)
+            ),
+            project=version_to_project[version],
+            concurrency=common.concurrent_targets("linux", versions, jobs),
+            name=f"Python {version}",
         )
-        common.rsync(build, host_path=output, guest_path="wheels/", host_to_guest=False)
+        harvester.harvest(f"wheels/{version}", version)
+
+    with harvester:
+        common.run_versions(build_version, versions, jobs)
+    if compiler_cache is not None:
+        common.print_info(f"Compiler cache statistics on Linux")
+        common.ccache(build, "linux", compiler_cache, "--show-stats")
@@ -11,67 +11,124 @@ def os_build(
     pre: pathlib.Path,
     post: pathlib.Path,
     pyproject: dict[str, typing.Any],
+    jobs: int,
+    cache: common.Cache,
+    incremental: bool,
+    upload: common.Upload,
+    compiler_cache: typing.Optional[float],
+    matrix: common.Matrix,
 ):
     common.print_info(f"Copying project files to Windows")
-    common.rsync_windows_utilities(build)
     common.vagrant_run(
-        build, "rmdir /s /q project 2>nul & rmdir /s /q wheels 2>nul & mkdir wheels"
+        build,
+        " & ".join(
+            (
+                "rmdir /s /q wheels 2>nul",
+                "mkdir wheels",
+                *(f"mkdir wheels\\{version}" for version in versions),
+            )
+        ),
+    )
+    guest_project = common.upload_project(
+        build, project, "windows", incremental, upload
     )
-    common.rsync(build, host_path=project, guest_path="project", host_to_guest=True)
-    for version in versions:
-        for version_string, python in (
+    harvester = common.Harvester(build, "windows", output, cache, matrix, versions)
+    if compiler_cache is not None:
+        common.ccache(build, "windows", compiler_cache, "--zero-stats")
+    target_to_workspace = common.windows_workspaces(
+        build, guest_project, versions, jobs, incremental
+    )
+
+    def build_target(version: str, architecture: str) -> None:
+        version_string = common.windows_version_string(version, architecture)
+        python = common.windows_python(version, architecture)
+        workspace = target_to_workspace[(version, architecture)]
+        home = common.workspace_home("windows", workspace)
+        new_wheels = f"{home}new-wheels\\{version}-{architecture}"
+        common.print_info(f"Building for Python {version_string} on Windows")
+        common.agent_run(
+            build,
+            "windows",
             (
-                version,
-                '"C:\\Program Files\\Python{}\\python.exe"'.format(
-                    version.replace(".", "")
+                common.Step(
+                    "prepare",
+                    f"rmdir /s /q {new_wheels} 2>nul & rmdir /s /q {new_wheels} 2>nul & mkdir {new_wheels}",
                 ),
-            ),
-            (
-                f"{version} (32 bits)",
-                '"C:\\Program Files (x86)\\Python{}-32\\python.exe"'.format(
-                    version.replace(".", "")
+                *(
+                    ()
+                    if pre is None
+                    else (
+                        common.Step(
+                            "pre",
+                            f"{python} {pre.as_posix()}",
+                            description=f"Running {pre.as_posix()}",
+                        ),
+                    )
                 ),
-            ),
-        ):
-            common.print_info(f"Building for Python {version_string} on Windows")
-            common.vagrant_run(
-                build,
-                " && ".join(
-                    (
-                        "echo off",
-                        "rmdir /s /q new-wheels 2>nul & rmdir /s /q new-wheels 2>nul & mkdir new-wheels",
-                        "cd project",
-                        *(
-                            ()
-                            if pre is None
-                            else (
-                                "{} ..\\utilities\\echo.py {}".format(
-                                    python, f"Running {pre.as_posix()}"
-                                ),
-                                "{} {}".format(python, pre.as_posix()),
-                            )
+                common.Step(
+                    "wheel",
+                    " && ".join(
+                        (
+                            *(
+                                ()
+                                if compiler_cache is None
+                                else (
+                                    f"call {home}utilities\\msvc-ccache.bat {architecture}",
+                                )
+                            ),
+                            "{} {}".format(python, common.pip_wheel(new_wheels)),
+                        )
+                    ),
+                    environment=common.wheelhouse_environment(
+                        build, "windows", pyproject, version, architecture
+                    ),
+                ),
+                *(
+                    ()
+                    if post is None
+                    else (
+                        common.Step(
+                            "install",
+                            "for %w in ({}\\*.whl) do {} {}".format(
+                                new_wheels, python, common.pip_install("%w")
+                            ),
+                        ),
+                        common.Step(
+                            "post",
+                            f"{python} {post.as_posix()}",
+                            description=f"Running {post.as_posix()}",
                         ),
-                        "{} {}".format(python, common.pip_wheel("..\\new-wheels")),
-                        *(
-                            ()
-                            if post is None
-                            else (
-                                "for %w in (..\\new-wheels\\*.whl) do {} {}".format(
-                                    python, common.pip_install("%w")
-                                ),
-                                "{} ..\\utilities\\echo.py {}".format(
-                                    python, f"Running {post.as_posix()}"
-                                ),
-                                "{} {}".format(python, post.as_posix()),
-                                "for %w in (..\\new-wheels\\*.whl) do {} {}".format(
-                                    python, common.pip_uninstall("%w")
-                                ),
-                            )
+                        common.Step(
+                            "uninstall",
+                            "for %w in ({}\\*.whl) do {} {}".format(
+                                new_wheels, python, common.pip_uninstall("%w")
+                            ),
                         ),
-                        "move /y ..\\new-wheels\\*.whl ..\\wheels\\",
                     )
                 ),
-            )
-            common.rsync(
-                build, host_path=output, guest_path="wheels", host_to_guest=False
-            )
+                common.Step(
+                    "collect",
+                    f"move /y {new_wheels}\\*.whl {home}wheels\\{version}\\",
+                ),
+            ),
+            cwd=workspace,
+            environment=(
+                {}
+                if compiler_cache is None
+                else common.ccache_environment("windows", compiler_cache)
+            ),
+            concurrency=common.concurrent_targets("windows", versions, jobs),
+            name=f"Python {version_string}",
+        )
+
+    with harvester:
+        common.run_windows_targets(
+            build_target,
+            versions,
+            jobs,
+            matrix,
+            lambda version: harvester.harvest(f"wheels/{version}", version),
+        )
+    if compiler_cache is not None:
+        common.print_info(f"Compiler cache statistics on Windows")
+        common.ccache(build, "windows", compiler_cache, "--show-stats")
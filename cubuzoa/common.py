@@ -1,11 +1,34 @@
+import base64
+import concurrent.futures
+import contextlib
 import datetime
+import functools
+import gzip
+import hashlib
+import json
 import os
+import packaging.requirements
+import packaging.tags
+import packaging.utils
+import packaging.version
 import pathlib
+import re
+import shlex
 import shutil
 import subprocess
+import tarfile
 import tempfile
+import threading
+import time
 import typing
 import sys
+import zipfile
+import zlib
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
 
 dirname = pathlib.Path(__file__).resolve().parent
 
@@ -59,6 +82,225 @@ os_to_configuration: dict[str, Configuration] = {
 }
 
 
+output_lock = threading.Lock()
+output_state = threading.local()
+
+
+def output_prefix() -> typing.Optional[str]:
+    return getattr(output_state, "prefix", None)
+
+
+@contextlib.contextmanager
+def prefixed_output(prefix: typing.Optional[str]) -> typing.Iterator[None]:
+    previous_prefix = output_prefix()
+    output_state.prefix = prefix
+    try:
+        yield
+    finally:
+        output_state.prefix = previous_prefix
+
+
+def output_log() -> typing.Optional[typing.TextIO]:
+    return getattr(output_state, "log", None)
+
+
+@contextlib.contextmanager
+def logged_output(name: str, log: pathlib.Path) -> typing.Iterator[None]:
+    previous_log = output_log()
+    previous_name = getattr(output_state, "name", None)
+    with open(log, "w", encoding="utf-8") as log_file:
+        output_state.log = log_file
+        output_state.name = name
+        try:
+            yield
+        finally:
+            output_state.log = previous_log
+            output_state.name = previous_name
+
+
+class Trace:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.begin = time.monotonic()
+        self.events: list[dict[str, typing.Any]] = []
+        self.process_to_pid: dict[str, int] = {}
+        self.thread_to_tid: dict[int, int] = {}
+        self.named_threads: set[tuple[int, int]] = set()
+
+    def add(
+        self,
+        name: str,
+        category: str,
+        begin: float,
+        end: float,
+        arguments: dict[str, typing.Any],
+    ) -> None:
+        process = getattr(output_state, "trace_process", None) or "cubuzoa"
+        thread = threading.current_thread()
+        ident = threading.get_ident()
+        with self.lock:
+            if not process in self.process_to_pid:
+                self.process_to_pid[process] = len(self.process_to_pid) + 1
+                self.events.append(
+                    {
+                        "name": "process_name",
+                        "ph": "M",
+                        "pid": self.process_to_pid[process],
+                        "args": {"name": process},
+                    }
+                )
+            if not ident in self.thread_to_tid:
+                self.thread_to_tid[ident] = len(self.thread_to_tid) + 1
+            pid = self.process_to_pid[process]
+            tid = self.thread_to_tid[ident]
+            if not (pid, tid) in self.named_threads:
+                self.named_threads.add((pid, tid))
+                self.events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": pid,
+                        "tid": tid,
+                        "args": {"name": thread.name},
+                    }
+                )
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": round((begin - self.begin) * 1e6),
+                    "dur": round((end - begin) * 1e6),
+                    "pid": pid,
+                    "tid": tid,
+                    "args": arguments,
+                }
+            )
+
+    def write(self, path: pathlib.Path) -> None:
+        with self.lock:
+            with open(path, "w", encoding="utf-8") as trace_file:
+                json.dump(
+                    {"traceEvents": self.events, "displayTimeUnit": "ms"}, trace_file
+                )
+
+
+trace: typing.Optional[Trace] = None
+
+
+def start_trace() -> None:
+    global trace
+    trace = Trace()
+
+
+@contextlib.contextmanager
+def traced(name: str, category: str, **arguments: typing.Any) -> typing.Iterator[None]:
+    if trace is None:
+        yield
+        return
+    begin = time.monotonic()
+    try:
+        yield
+    finally:
+        trace.add(name, category, begin, time.monotonic(), arguments)
+
+
+@contextlib.contextmanager
+def traced_process(process: typing.Optional[str]) -> typing.Iterator[None]:
+    previous_process = getattr(output_state, "trace_process", None)
+    output_state.trace_process = process
+    try:
+        yield
+    finally:
+        output_state.trace_process = previous_process
+
+
+task_to_status: dict[str, tuple[str, float]] = {}
+
+
+def set_status(status: str) -> None:
+    name = getattr(output_state, "name", None)
+    if name is None:
+        return
+    with output_lock:
+        task_to_status[name] = (status, time.monotonic())
+    print_status()
+
+
+def print_status() -> None:
+    now = time.monotonic()
+    with output_lock:
+        if len(task_to_status) > 0:
+            print(
+                format_info(
+                    " | ".join(
+                        f"{name}: {status} ({format_duration(now - begin)})"
+                        for name, (status, begin) in sorted(task_to_status.items())
+                    )
+                ),
+                flush=True,
+            )
+
+
+def print_line(message: str) -> None:
+    log = output_log()
+    if log is not None:
+        log.write(f"{message}\n")
+        log.flush()
+        return
+    prefix = output_prefix()
+    with output_lock:
+        if prefix is None:
+            print(message, flush=True)
+        else:
+            for line in message.split("\n"):
+                print(f"{prefix}{line}", flush=True)
+
+
+os_to_guest_caches: dict[str, str] = {
+    "linux": "/home/vagrant/caches",
+    "macos": "/Users/vagrant/caches",
+    "windows": "C:\\Users\\vagrant\\caches",
+}
+
+os_to_sccache: dict[str, str] = {
+    "linux": "/root/.cargo/bin/sccache",
+    "macos": "/usr/local/bin/sccache",
+    "windows": "C:\\Users\\vagrant\\.cargo\\bin\\sccache.exe",
+}
+
+
+os_to_ccache: dict[str, str] = {
+    "linux": "ccache",
+    "macos": "/usr/local/bin/ccache",
+    "windows": "ccache",
+}
+
+
+def guest_python(os_name: str) -> str:
+    if os_name == "linux":
+        return "python3"
+    if os_name == "macos":
+        return "/Users/vagrant/.pyenv/versions/{}/bin/python3".format(
+            os_to_configuration["macos"].default_name()
+        )
+    return '"C:\\Program Files\\Python{}\\python.exe"'.format(
+        os_to_configuration["windows"].default_version().replace(".", "")
+    )
+
+
+def macos_python(version: str) -> str:
+    return "/Users/vagrant/.pyenv/versions/{}/bin/python3".format(
+        os_to_configuration["macos"].version_to_name[version]
+    )
+
+
+def guest_path(os_name: str, *parts: str) -> str:
+    if os_name == "windows":
+        return str(pathlib.PureWindowsPath(*parts))
+    return str(pathlib.PurePosixPath(*parts))
+
+
 def format_bold(message: str) -> str:
     if os.getenv("ANSI_COLORS_DISABLED") is None:
         return f"\033[1m{message}\033[0m"
@@ -66,7 +308,7 @@ def format_bold(message: str) -> str:
 
 
 def print_bold(message: str) -> None:
-    print(format_bold(message))
+    print_line(format_bold(message))
 
 
 def format_info(message: str) -> str:
@@ -74,7 +316,7 @@ def format_info(message: str) -> str:
 
 
 def print_info(message: str) -> None:
-    print(format_info(message))
+    print_line(format_info(message))
 
 
 def format_warning(message: str) -> str:
@@ -82,7 +324,7 @@ def format_warning(message: str) -> str:
 
 
 def print_warning(message: str) -> None:
-    print(format_warning(message))
+    print_line(format_warning(message))
 
 
 def format_error(message: str) -> str:
@@ -90,7 +332,7 @@ def format_error(message: str) -> str:
 
 
 def print_error(message: str) -> None:
-    print(format_error(message))
+    print_line(format_error(message))
 
 
 def versions_to_string(versions: list[str]) -> str:
@@ -103,6 +345,176 @@ def versions_to_string(versions: list[str]) -> str:
     return f'{", ".join(versions[:-1])}, and {versions[-1]}'
 
 
+def format_size(size: int) -> str:
+    return f"{size / 1e9:.2f} GB"
+
+
+def format_duration(duration: float) -> str:
+    return str(datetime.timedelta(seconds=round(duration)))
+
+
+def command_name(args: typing.Sequence[typing.Union[str, pathlib.Path]]) -> str:
+    program = pathlib.Path(args[0]).name
+    if program in {"vagrant", "VBoxManage", "docker"} and len(args) > 1:
+        return f"{program} {args[1]}"
+    return program
+
+
+def command_string(args: typing.Sequence[typing.Union[str, pathlib.Path]]) -> str:
+    command = " ".join(str(argument) for argument in args)
+    if len(command) > 256:
+        return f"{command[:256]}..."
+    return command
+
+
+def run_process(
+    args: typing.Sequence[typing.Union[str, pathlib.Path]], **kwargs: typing.Any
+) -> subprocess.CompletedProcess:
+    with traced(command_name(args), "subprocess", command=command_string(args)):
+        return subprocess.run(args, **kwargs)
+
+
+def call(
+    args: typing.Sequence[typing.Union[str, pathlib.Path]],
+    cwd: typing.Optional[pathlib.Path] = None,
+    env: typing.Optional[typing.Mapping[str, str]] = None,
+    handle_line: typing.Optional[typing.Callable[[str], None]] = None,
+) -> int:
+    with traced(command_name(args), "subprocess", command=command_string(args)):
+        if output_prefix() is None and output_log() is None and handle_line is None:
+            return subprocess.call(args, cwd=cwd, env=env)
+        if handle_line is None:
+            handle_line = print_line
+        with subprocess.Popen(
+            args,
+            cwd=cwd,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        ) as process:
+            assert process.stdout is not None
+            for line in process.stdout:
+                handle_line(
+                    line.decode("utf-8", errors="replace")
+                    .rstrip("\r\n")
+                    .split("\r")[-1]
+                )
+            return process.wait()
+
+
+def check_call(
+    args: typing.Sequence[typing.Union[str, pathlib.Path]],
+    cwd: typing.Optional[pathlib.Path] = None,
+    env: typing.Optional[typing.Mapping[str, str]] = None,
+    handle_line: typing.Optional[typing.Callable[[str], None]] = None,
+) -> None:
+    returncode = call(args, cwd=cwd, env=env, handle_line=handle_line)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, args)
+
+
+class Outcome:
+    def __init__(
+        self, name: str, duration: float, error: typing.Optional[BaseException]
+    ):
+        self.name = name
+        self.duration = duration
+        self.error = error
+
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+def run_tasks(
+    tasks: list[tuple[str, typing.Callable[[], None]]],
+    jobs: int,
+    logs: typing.Optional[dict[str, pathlib.Path]] = None,
+) -> list[Outcome]:
+    jobs = max(1, min(jobs, len(tasks)))
+    width = max((len(name) for name, _ in tasks), default=0)
+    parent_prefix = output_prefix()
+    parent_process = getattr(output_state, "trace_process", None)
+
+    def run(name: str, task: typing.Callable[[], None]) -> Outcome:
+        begin = time.monotonic()
+        prefix = (
+            parent_prefix
+            if jobs == 1
+            else f"{'' if parent_prefix is None else parent_prefix}{name:<{width}} | "
+        )
+        error: typing.Optional[BaseException] = None
+        with (
+            prefixed_output(prefix) if logs is None else logged_output(name, logs[name])
+        ), traced_process(parent_process or name), traced(name, "task"):
+            set_status("started")
+            try:
+                task()
+                set_status("done")
+            except (Exception, SystemExit) as task_error:
+                set_status("failed")
+                error = task_error
+        if error is not None:
+            with prefixed_output(prefix):
+                print_error(f"{name} failed ({error})")
+                if logs is not None:
+                    with open(logs[name], encoding="utf-8") as log_file:
+                        print_line("\n".join(log_file.read().split("\n")[-21:-1]))
+        return Outcome(name, time.monotonic() - begin, error)
+
+    done = threading.Event()
+
+    def report_status() -> None:
+        while not done.wait(30.0):
+            print_status()
+
+    if logs is not None:
+        threading.Thread(target=report_status, daemon=True).start()
+    try:
+        if jobs == 1:
+            return [run(name, task) for name, task in tasks]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(lambda name_and_task: run(*name_and_task), tasks))
+    finally:
+        done.set()
+
+
+def run_versions(
+    function: typing.Callable[[str], None], versions: tuple[str, ...], jobs: int
+) -> None:
+    if jobs <= 1 or len(versions) <= 1:
+        for version in versions:
+            function(version)
+        return
+    outcomes = run_tasks(
+        [(version, functools.partial(function, version)) for version in versions],
+        jobs=jobs,
+    )
+    failed_versions = [outcome.name for outcome in outcomes if not outcome.succeeded()]
+    if len(failed_versions) > 0:
+        raise Exception(
+            f"the build failed for Python {versions_to_string(failed_versions)}"
+        )
+
+
+def print_summary(outcomes: list[Outcome], duration: float) -> None:
+    for outcome in outcomes:
+        if outcome.succeeded():
+            print_info(
+                f"{outcome.name} succeeded in {format_duration(outcome.duration)}"
+            )
+        else:
+            print_error(
+                f"{outcome.name} failed after {format_duration(outcome.duration)}"
+            )
+    succeeded = sum(1 for outcome in outcomes if outcome.succeeded())
+    message = f"{succeeded} of {len(outcomes)} succeeded in {format_duration(duration)}"
+    if succeeded == len(outcomes):
+        print_info(message)
+    else:
+        print_error(message)
+
+
 def box_name(os_name: str) -> str:
     return "cubuzoa-{}-{}".format(
         os_name, datetime.datetime.today().isoformat().split(".")[0]
@@ -110,40 +522,39 @@ def box_name(os_name: str) -> str:
 
 
 def vagrant_plugin(plugin: str) -> None:
-    plugins_string = subprocess.run(
+    plugins_string = run_process(
         ("vagrant", "plugin", "list"), check=True, capture_output=True, encoding="utf-8"
     )
     plugins = set(
         plugin.split(" ")[0] for plugin in plugins_string.stdout[:-1].split("\n")
     )
     if plugin in plugins:
-        subprocess.check_call(("vagrant", "plugin", "update", plugin))
+        check_call(("vagrant", "plugin", "update", plugin))
     else:
-        subprocess.check_call(("vagrant", "plugin", "install", plugin))
+        check_call(("vagrant", "plugin", "install", plugin))
 
 
 def vagrant_add(box: str) -> None:
-    boxes_string = subprocess.run(
+    set_status(f"downloading {box}")
+    boxes_string = run_process(
         ("vagrant", "box", "list"), check=True, capture_output=True, encoding="utf-8"
     )
     boxes = set(box.split(" ")[0] for box in boxes_string.stdout[:-1].split("\n"))
     if box in boxes:
-        subprocess.check_call(
+        check_call(
             ("vagrant", "box", "update", "--box", box, "--provider", "virtualbox")
         )
     else:
-        subprocess.check_call(
-            ("vagrant", "box", "add", box, "--provider", "virtualbox")
-        )
+        check_call(("vagrant", "box", "add", box, "--provider", "virtualbox"))
 
 
 def vagrant_remove(box: str) -> None:
-    boxes_string = subprocess.run(
+    boxes_string = run_process(
         ("vagrant", "box", "list"), check=True, capture_output=True, encoding="utf-8"
     )
     boxes = set(box.split(" ")[0] for box in boxes_string.stdout[:-1].split("\n"))
     if box in boxes:
-        subprocess.check_call(("vagrant", "box", "remove", box, "--all"))
+        check_call(("vagrant", "box", "remove", box, "--all"))
 
 
 def vagrant_up(build: pathlib.Path, experimental: typing.Optional[str] = None) -> None:
@@ -152,138 +563,1995 @@ def vagrant_up(build: pathlib.Path, experimental: typing.Optional[str] = None) -
         env["VAGRANT_EXPERIMENTAL"] = experimental
     else:
         env = os.environ
-    subprocess.check_call(("vagrant", "up"), cwd=build, env=env)
+    set_status("booting and provisioning")
+    check_call(("vagrant", "up"), cwd=build, env=env)
 
 
-def vagrant_run(build: pathlib.Path, command: str) -> None:
-    subprocess.check_call(("vagrant", "ssh", "--", command), cwd=build)
+class SshConfiguration:
+    def __init__(
+        self, host: str, port: int, user: str, identity_files: list[pathlib.Path]
+    ):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.identity_files = identity_files
+        self.connected = False
+
+    def destination(self) -> str:
+        return f"{self.user}@{self.host}"
+
+    def options(self) -> list[str]:
+        options = [
+            "-o",
+            "LogLevel=ERROR",
+            "-o",
+            "StrictHostKeyChecking=no",
+            "-o",
+            f"UserKnownHostsFile={os.devnull}",
+            "-o",
+            "IdentitiesOnly=yes",
+            "-o",
+            "BatchMode=yes",
+            "-p",
+            str(self.port),
+        ]
+        for identity_file in self.identity_files:
+            options += ["-i", str(identity_file)]
+        if os.name != "nt":
+            options += [
+                "-o",
+                "ControlMaster=auto",
+                "-o",
+                "ControlPath=/tmp/cubuzoa-%C",
+                "-o",
+                "ControlPersist=600",
+            ]
+        return options
+
+
+build_to_ssh_configuration: dict[pathlib.Path, SshConfiguration] = {}
+ssh_configuration_lock = threading.Lock()
+
+
+def ssh_configuration(build: pathlib.Path) -> typing.Optional[SshConfiguration]:
+    with ssh_configuration_lock:
+        if build in build_to_ssh_configuration:
+            return build_to_ssh_configuration[build]
+        result = run_process(
+            ("vagrant", "ssh-config"),
+            cwd=build,
+            check=False,
+            capture_output=True,
+            encoding="utf-8",
+        )
+        if result.returncode != 0:
+            return None
+        host: typing.Optional[str] = None
+        port: typing.Optional[int] = None
+        user: typing.Optional[str] = None
+        identity_files: list[pathlib.Path] = []
+        for line in result.stdout.split("\n"):
+            key, _, value = line.strip().partition(" ")
+            value = value.strip().strip('"')
+            if key == "HostName":
+                host = value
+            elif key == "Port":
+                port = int(value)
+            elif key == "User":
+                user = value
+            elif key == "IdentityFile":
+                identity_files.append(pathlib.Path(value))
+        if host is None or port is None or user is None:
+            return None
+        build_to_ssh_configuration[build] = SshConfiguration(
+            host=host, port=port, user=user, identity_files=identity_files
+        )
+        return build_to_ssh_configuration[build]
+
+
+def connected_ssh_configuration(
+    build: pathlib.Path,
+) -> typing.Optional[SshConfiguration]:
+    configuration = ssh_configuration(build)
+    if configuration is None or configuration.connected:
+        return configuration
+    if (
+        run_process(
+            ("ssh", *configuration.options(), configuration.destination(), "exit 0"),
+            check=False,
+            capture_output=True,
+        ).returncode
+        != 0
+    ):
+        forget_ssh_configuration(build)
+        print_warning("the SSH connection failed, falling back to vagrant ssh")
+        return None
+    configuration.connected = True
+    return configuration
+
+
+def forget_ssh_configuration(build: pathlib.Path) -> None:
+    with ssh_configuration_lock:
+        build_to_ssh_configuration.pop(build, None)
+
+
+def close_ssh_connection(build: pathlib.Path) -> None:
+    with ssh_configuration_lock:
+        configuration = build_to_ssh_configuration.pop(build, None)
+    if configuration is not None and os.name != "nt":
+        run_process(
+            (
+                "ssh",
+                *configuration.options(),
+                "-O",
+                "exit",
+                configuration.destination(),
+            ),
+            check=False,
+            capture_output=True,
+        )
+
+
+def vagrant_run(
+    build: pathlib.Path,
+    command: str,
+    handle_line: typing.Optional[typing.Callable[[str], None]] = None,
+) -> None:
+    configuration = connected_ssh_configuration(build)
+    if configuration is not None:
+        returncode = call(
+            ("ssh", *configuration.options(), configuration.destination(), command),
+            handle_line=handle_line,
+        )
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+        return
+    check_call(("vagrant", "ssh", "--", command), cwd=build, handle_line=handle_line)
+
+
+def vagrant_output(build: pathlib.Path, command: str) -> str:
+    configuration = connected_ssh_configuration(build)
+    if configuration is not None:
+        result = run_process(
+            ("ssh", *configuration.options(), configuration.destination(), command),
+            capture_output=True,
+            encoding="utf-8",
+        )
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(
+                result.returncode, command, result.stdout, result.stderr
+            )
+        return result.stdout
+    return run_process(
+        ("vagrant", "ssh", "--", command),
+        cwd=build,
+        check=True,
+        capture_output=True,
+        encoding="utf-8",
+    ).stdout
 
 
 def vagrant_suspend(build: pathlib.Path) -> None:
     if (
         build.exists()
-        and subprocess.run(
+        and run_process(
             ("vagrant", "status"), check=False, capture_output=True, cwd=build
         ).returncode
         == 0
     ):
-        subprocess.call(("vagrant", "suspend"), cwd=build)
+        set_status("suspending")
+        close_ssh_connection(build)
+        call(("vagrant", "suspend"), cwd=build)
 
 
 def vagrant_resume(build: pathlib.Path) -> None:
     if (
         build.exists()
-        and subprocess.run(
+        and run_process(
             ("vagrant", "status"), check=False, capture_output=True, cwd=build
         ).returncode
         == 0
     ):
-        subprocess.call(("vagrant", "resume"), cwd=build)
+        call(("vagrant", "resume"), cwd=build)
 
 
 def vagrant_halt(build: pathlib.Path) -> None:
     if (
         build.exists()
-        and subprocess.run(
+        and run_process(
             ("vagrant", "status"), check=False, capture_output=True, cwd=build
         ).returncode
         == 0
     ):
-        subprocess.call(("vagrant", "halt"), cwd=build)
+        close_ssh_connection(build)
+        call(("vagrant", "halt"), cwd=build)
 
 
 def vagrant_destroy(build: pathlib.Path) -> None:
     if (
         build.exists()
-        and subprocess.run(
+        and run_process(
             ("vagrant", "status"), check=False, capture_output=True, cwd=build
         ).returncode
         == 0
     ):
-        subprocess.call(("vagrant", "destroy", "-f"), cwd=build)
+        close_ssh_connection(build)
+        call(("vagrant", "destroy", "-f"), cwd=build)
     shutil.rmtree(build / ".vagrant", ignore_errors=True)
 
 
-def vboxmanage(build: pathlib.Path, command: str, *args: str) -> None:
+def machine_uuid(build: pathlib.Path) -> str:
     with open(
         build / ".vagrant" / "machines" / "default" / "virtualbox" / "id"
     ) as uuid_file:
-        uuid = uuid_file.read()
-    subprocess.check_call(("VBoxManage", *command, uuid, *args), cwd=build)
+        return uuid_file.read().strip()
+
+
+def vboxmanage(build: pathlib.Path, command: str, *args: str) -> None:
+    check_call(("VBoxManage", command, machine_uuid(build), *args), cwd=build)
+
+
+def vboxmanage_output(build: pathlib.Path, command: str, *args: str) -> str:
+    return run_process(
+        ("VBoxManage", command, machine_uuid(build), *args),
+        cwd=build,
+        check=True,
+        capture_output=True,
+        encoding="utf-8",
+    ).stdout
+
+
+snapshot_name = "cubuzoa-provisioned"
+
+
+def machine_info(build: pathlib.Path) -> dict[str, str]:
+    info: dict[str, str] = {}
+    for line in vboxmanage_output(build, "showvminfo", "--machinereadable").split("\n"):
+        key, _, value = line.partition("=")
+        info[key.strip('"')] = value.strip().strip('"')
+    return info
+
+
+def machine_state(build: pathlib.Path) -> str:
+    return machine_info(build).get("VMState", "unknown")
+
+
+def host_memory() -> typing.Optional[int]:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1 << 20)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def machine_resources(
+    cpus: typing.Optional[int], memory: typing.Optional[int]
+) -> dict[str, int]:
+    host_cpus = os.cpu_count() or 2
+    if cpus is None:
+        cpus = max(2, host_cpus // 2)
+    if memory is None:
+        total_memory = host_memory()
+        if total_memory is None:
+            memory = 4096
+        else:
+            memory = min(
+                max(2048, total_memory // (len(os_to_configuration) + 1)), 16384
+            )
+    return {"cpus": max(1, min(cpus, host_cpus)), "memory": max(1024, memory)}
+
+
+def write_resources(build: pathlib.Path, resources: dict[str, int]) -> None:
+    with open(build / "resources.json", "w") as resources_file:
+        json.dump(resources, resources_file)
+
+
+def vagrantfile_resources() -> tuple[str, ...]:
+    return (
+        '        resources = JSON.parse(File.read(File.join(__dir__, "resources.json")))',
+        '        v.cpus = resources["cpus"]',
+        '        v.memory = resources["memory"]',
+    )
+
+
+build_to_cpus: dict[pathlib.Path, int] = {}
+
+
+def guest_cpus(build: pathlib.Path) -> int:
+    if not build in build_to_cpus:
+        build_to_cpus[build] = max(1, int(machine_info(build).get("cpus", "1")))
+    return build_to_cpus[build]
+
+
+def concurrent_targets(os_name: str, versions: tuple[str, ...], jobs: int) -> int:
+    targets = len(versions) * (
+        len(windows_architectures) if os_name == "windows" else 1
+    )
+    return max(1, min(jobs, targets))
+
+
+def parallelism_environment(
+    build: pathlib.Path, os_name: str, concurrency: int = 1
+) -> dict[str, str]:
+    cpus = max(1, guest_cpus(build) // concurrency)
+    environment = {
+        "MAKEFLAGS": f"-j{cpus}",
+        "CARGO_BUILD_JOBS": str(cpus),
+        "CMAKE_BUILD_PARALLEL_LEVEL": str(cpus),
+    }
+    if os_name == "windows":
+        environment["CL"] = f"/MP{cpus}"
+    return environment
+
+
+def resize_machine(build: pathlib.Path, resources: dict[str, int]) -> None:
+    write_resources(build, resources)
+    state = machine_state(build)
+    if not state in {"poweroff", "aborted"}:
+        print_info("Shutting down the machine to resize it")
+        wake_guest(build)
+        vagrant_halt(build)
+    print_info(
+        f"Setting {resources['cpus']} CPUs and {resources['memory']} MB of memory"
+    )
+    vboxmanage(
+        build,
+        "modifyvm",
+        "--cpus",
+        str(resources["cpus"]),
+        "--memory",
+        str(resources["memory"]),
+    )
+    build_to_cpus.pop(build, None)
+    if not state in {"poweroff", "aborted"}:
+        wake_guest(build)
+        if state in {"saved", "aborted-saved"}:
+            vagrant_suspend(build)
+
+
+def has_snapshot(build: pathlib.Path) -> bool:
+    result = run_process(
+        ("VBoxManage", "snapshot", machine_uuid(build), "list", "--machinereadable"),
+        cwd=build,
+        check=False,
+        capture_output=True,
+        encoding="utf-8",
+    )
+    return result.returncode == 0 and f'="{snapshot_name}"' in result.stdout
+
+
+def take_snapshot(build: pathlib.Path) -> None:
+    with traced("take snapshot", "phase"):
+        print_info(f"Taking the snapshot {snapshot_name}")
+        set_status("taking a snapshot")
+        if has_snapshot(build):
+            vboxmanage(build, "snapshot", "delete", snapshot_name)
+        vboxmanage(build, "snapshot", "take", snapshot_name, "--live")
+
+
+def restore_snapshot(build: pathlib.Path) -> None:
+    with traced("restore snapshot", "phase"):
+        if not has_snapshot(build):
+            raise Exception(
+                f'the machine in "{build}" does not have a snapshot, run python3 -m cubuzoa snapshot first'
+            )
+        print_info(f"Restoring the snapshot {snapshot_name}")
+        close_ssh_connection(build)
+        state = machine_state(build)
+        if state in {"running", "paused", "stuck"}:
+            vboxmanage(build, "controlvm", "poweroff")
+        elif state == "saved":
+            vboxmanage(build, "discardstate")
+        vboxmanage(build, "snapshot", "restore", snapshot_name)
+        vboxmanage(build, "startvm", "--type", "headless")
+
+
+def provisioned(build: pathlib.Path) -> bool:
+    return (build / ".vagrant" / "machines" / "default" / "virtualbox" / "id").is_file()
+
+
+def wait_for_guest(build: pathlib.Path, timeout: float = 600.0) -> None:
+    set_status("waiting for SSH")
+    deadline = time.monotonic() + timeout
+    while True:
+        configuration = ssh_configuration(build)
+        if (
+            configuration is not None
+            and run_process(
+                (
+                    "ssh",
+                    *configuration.options(),
+                    "-o",
+                    "ConnectTimeout=10",
+                    configuration.destination(),
+                    "exit 0",
+                ),
+                check=False,
+                capture_output=True,
+            ).returncode
+            == 0
+        ):
+            configuration.connected = True
+            return
+        forget_ssh_configuration(build)
+        if time.monotonic() > deadline:
+            raise Exception(
+                f'the machine in "{build}" did not accept SSH connections after {format_duration(timeout)}'
+            )
+        time.sleep(1.0)
+
+
+def wake_guest(build: pathlib.Path) -> None:
+    if not provisioned(build):
+        raise Exception(
+            f'the machine in "{build}" does not exist, run python3 -m cubuzoa provision first'
+        )
+    info = machine_info(build)
+    state = info.get("VMState", "unknown")
+    build_to_cpus[build] = max(1, int(info.get("cpus", "1")))
+    with traced("wake", "phase", state=state):
+        if state in {"saved", "aborted-saved", "poweroff", "aborted"}:
+            print_info(f"Starting the machine (it was {state})")
+            set_status("starting")
+            close_ssh_connection(build)
+            vboxmanage(build, "startvm", "--type", "headless")
+        elif state == "paused":
+            print_info("Resuming the paused machine")
+            vboxmanage(build, "controlvm", "resume")
+        elif state != "running":
+            raise Exception(f'the machine in "{build}" is in the state "{state}"')
+        wait_for_guest(build)
+
+
+@contextlib.contextmanager
+def guest_lock(build: pathlib.Path) -> typing.Iterator[None]:
+    with open(build / "guest.lock", "w") as lock_file:
+        if sys.platform == "win32":
+            waiting = False
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    if not waiting:
+                        print_info("Waiting for another build to release the machine")
+                        set_status("waiting for another build")
+                        waiting = True
+                    time.sleep(1.0)
+        else:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                print_info("Waiting for another build to release the machine")
+                set_status("waiting for another build")
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+idle_heartbeat_interval = 30.0
+
+
+def mark_used(build: pathlib.Path, idle_ttl: typing.Optional[float]) -> None:
+    if idle_ttl is None:
+        try:
+            os.utime(build / "idle.json")
+        except FileNotFoundError:
+            pass
+    else:
+        with open(build / "idle.json", "w") as idle_file:
+            json.dump({"ttl": idle_ttl}, idle_file)
+
+
+@contextlib.contextmanager
+def guest_in_use(
+    build: pathlib.Path, idle_ttl: typing.Optional[float]
+) -> typing.Iterator[None]:
+    mark_used(build, idle_ttl)
+    stop = threading.Event()
+
+    def heartbeat() -> None:
+        while not stop.wait(idle_heartbeat_interval):
+            mark_used(build, None)
+
+    thread = threading.Thread(target=heartbeat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+        mark_used(build, None)
+
+
+def start_idle_watcher(build: pathlib.Path) -> None:
+    heartbeat = build / "idle-watcher"
+    if (
+        heartbeat.is_file()
+        and time.time() - heartbeat.stat().st_mtime < 3 * idle_heartbeat_interval
+    ):
+        return
+    heartbeat.touch()
+    with open(build / "idle-watcher.log", "a") as log:
+        subprocess.Popen(
+            (sys.executable, "-m", "cubuzoa", "idle", "--build", str(build.resolve())),
+            cwd=dirname.parent,
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+            creationflags=getattr(subprocess, "DETACHED_PROCESS", 0),
+        )
+
+
+def suspend_idle(build: pathlib.Path) -> None:
+    heartbeat = build / "idle-watcher"
+    while True:
+        heartbeat.touch()
+        delays: list[float] = []
+        for path in sorted(build.glob("*/idle.json")):
+            try:
+                with open(path) as idle_file:
+                    idle_ttl = json.load(idle_file)["ttl"]
+                idle = time.time() - path.stat().st_mtime
+            except (FileNotFoundError, ValueError):
+                continue
+            if idle < idle_ttl:
+                delays.append(idle_ttl - idle)
+                continue
+            path.unlink(missing_ok=True)
+            if provisioned(path.parent) and machine_state(path.parent) in {
+                "running",
+                "paused",
+            }:
+                print_info(
+                    f"Suspending {path.parent.name}, unused for {format_duration(idle)}"
+                )
+                vagrant_suspend(path.parent)
+        if len(delays) == 0:
+            heartbeat.unlink(missing_ok=True)
+            return
+        time.sleep(min(min(delays) + 1.0, idle_heartbeat_interval))
+
+
+def transfer_ssh_configuration(build: pathlib.Path) -> SshConfiguration:
+    configuration = ssh_configuration(build)
+    if configuration is not None:
+        return configuration
+    return SshConfiguration(
+        host="127.0.0.1",
+        port=int(
+            run_process(
+                ("vagrant", "port", "--guest", "22"),
+                cwd=build,
+                check=True,
+                capture_output=True,
+                encoding="utf-8",
+            ).stdout
+        ),
+        user="vagrant",
+        identity_files=[dirname / "vagrant_private_key"],
+    )
 
 
 def rsync(
-    build: pathlib.Path, host_path: pathlib.Path, guest_path: str, host_to_guest: bool
+    build: pathlib.Path,
+    host_path: pathlib.Path,
+    guest_path: str,
+    host_to_guest: bool,
+    options: tuple[str, ...] = (),
+    files: typing.Optional[list[str]] = None,
+    compression: int = 6,
 ) -> None:
-    port = int(
-        subprocess.run(
-            ("vagrant", "port", "--guest", "22"),
-            cwd=build,
-            check=True,
-            capture_output=True,
-            encoding="utf-8",
-        ).stdout
-    )
-    private_key = dirname / "vagrant_private_key"
-    ssh = f"ssh -o LogLevel=ERROR -o StrictHostKeyChecking=no -o UserKnownHostsFile={os.devnull} -i {private_key} -p {port}"
-    if host_to_guest:
-        subprocess.check_call(
+    configuration = transfer_ssh_configuration(build)
+    ssh = " ".join(shlex.quote(part) for part in ("ssh", *configuration.options()))
+    if compression > 0:
+        options = ("-z", f"--compress-level={compression}", *options)
+    destination = configuration.destination()
+    if host_to_guest and files is not None:
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            files_path = pathlib.Path(temporary_directory) / "files"
+            with open(files_path, "wb") as files_file:
+                files_file.write(b"\0".join(os.fsencode(name) for name in files))
+            check_call(
+                (
+                    "rsync",
+                    "-a",
+                    "--from0",
+                    f"--files-from={files_path}",
+                    *options,
+                    "-e",
+                    ssh,
+                    f"{host_path}{os.sep}",
+                    f"{destination}:{guest_path}",
+                )
+            )
+    elif host_to_guest:
+        check_call(
             (
                 "rsync",
-                "-az",
+                "-a",
                 "--filter=:- .gitignore",
                 "--exclude=.git",
+                *options,
                 "-e",
                 ssh,
                 f"{host_path}{os.sep}",
-                f"vagrant@127.0.0.1:{guest_path}",
+                f"{destination}:{guest_path}",
             )
         )
     else:
-        subprocess.check_call(
+        check_call(
             (
                 "rsync",
-                "-az",
+                "-a",
+                *options,
                 "-e",
                 ssh,
-                f"vagrant@127.0.0.1:{guest_path}{os.sep}",
+                f"{destination}:{guest_path}{os.sep}",
                 f"{host_path}",
             )
         )
 
 
-def linux_docker_run(build: pathlib.Path, command: str) -> None:
-    vagrant_run(
-        build,
-        " ".join(
-            (
-                "sudo /usr/bin/docker run",
-                "--rm",
-                "-e BASH_ENV=/root/.profile",
-                "-v ~/project:/project",
-                "-v ~/wheels:/wheels",
-                "-v ~/build:/build",
-                "manylinux",
-                f"/bin/bash -c $'{command}'",
+def workspace(project: pathlib.Path) -> str:
+    return "workspace-{}-{}".format(
+        re.sub(r"[^\w.-]", "_", project.name),
+        hashlib.sha256(str(project).encode("utf-8")).hexdigest()[:8],
+    )
+
+
+project_to_git_files: dict[pathlib.Path, typing.Optional[list[str]]] = {}
+git_files_lock = threading.Lock()
+
+
+def git_files(project: pathlib.Path) -> typing.Optional[list[str]]:
+    with git_files_lock:
+        if project in project_to_git_files:
+            return project_to_git_files[project]
+        try:
+            result = run_process(
+                ("git", "ls-files", "-z", "--cached", "--others", "--exclude-standard"),
+                cwd=project,
+                check=False,
+                capture_output=True,
             )
-        ),
+        except FileNotFoundError:
+            result = None
+        files: typing.Optional[list[str]] = None
+        if result is not None and result.returncode == 0:
+            files = sorted(
+                set(
+                    name
+                    for name in (
+                        os.fsdecode(name) for name in result.stdout.split(b"\0")
+                    )
+                    if len(name) > 0 and os.path.lexists(project / name)
+                )
+            )
+            if any(
+                (project / name).is_dir() and not (project / name).is_symlink()
+                for name in files
+            ):
+                files = None
+        project_to_git_files[project] = files
+        return files
+
+
+class Upload:
+    def __init__(self, method: str, compression: int):
+        self.method = method
+        self.compression = compression
+
+
+def guest_empty(build: pathlib.Path, os_name: str, guest_path: str) -> bool:
+    python = guest_python(os_name)
+    if os_name == "linux":
+        python = f"sudo {python}"
+    return (
+        vagrant_output(
+            build,
+            f'{python} -c "'
+            + "import os;"
+            + f"r='{guest_path}';"
+            + "print(len(os.listdir(r)) if os.path.isdir(r) else 0)"
+            + '"',
+        ).strip()
+        == "0"
     )
 
 
-def rsync_windows_utilities(build: pathlib.Path) -> None:
+def tar_upload(
+    build: pathlib.Path,
+    project: pathlib.Path,
+    os_name: str,
+    guest_path: str,
+    files: list[str],
+    compression: int,
+    clear: bool,
+) -> None:
+    extract = f"-x{'z' if compression > 0 else ''}f - -C {guest_path}"
+    if os_name == "windows":
+        command = (
+            f"mkdir {guest_path} 2>nul & %SystemRoot%\\System32\\tar.exe {extract}"
+        )
+        if clear:
+            command = f"(if exist {guest_path} rmdir /s /q {guest_path}) & {command}"
+    else:
+        command = f"mkdir -p {guest_path} && tar {extract}"
+        if clear:
+            remove = "sudo rm -rf" if os_name == "linux" else "rm -rf"
+            command = f"{remove} {guest_path} && {command}"
+    configuration = transfer_ssh_configuration(build)
+    args = ("ssh", *configuration.options(), configuration.destination(), command)
+    with traced(
+        command_name(args), "subprocess", command=command_string(args)
+    ), tempfile.TemporaryFile() as output:
+        with subprocess.Popen(
+            args,
+            bufsize=0,
+            stdin=subprocess.PIPE,
+            stdout=output,
+            stderr=subprocess.STDOUT,
+        ) as process:
+            assert process.stdin is not None
+            try:
+                stream: typing.Union[typing.IO[bytes], gzip.GzipFile] = process.stdin
+                if compression > 0:
+                    stream = gzip.GzipFile(
+                        fileobj=process.stdin, mode="wb", compresslevel=compression
+                    )
+                with tarfile.open(fileobj=stream, mode="w|") as archive:
+                    for name in files:
+                        archive.add(project / name, arcname=name, recursive=False)
+                stream.close()
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            returncode = process.wait()
+        if returncode != 0:
+            output.seek(0)
+            for line in output.read().decode("utf-8", errors="replace").splitlines():
+                print_line(line)
+            raise subprocess.CalledProcessError(returncode, command)
+
+
+def image_archive(image_cache: pathlib.Path, key: str) -> pathlib.Path:
+    return image_cache / f"manylinux-{key}.tar.gz"
+
+
+def save_linux_image(build: pathlib.Path, archive: pathlib.Path) -> None:
+    command = "set -o pipefail && sudo /usr/bin/docker save manylinux | gzip -1"
+    configuration = transfer_ssh_configuration(build)
+    args = ("ssh", *configuration.options(), configuration.destination(), command)
+    archive.parent.mkdir(parents=True, exist_ok=True)
+    partial_archive = archive.parent / f".{archive.name}.partial"
+    print_info(f"Saving the manylinux image to {archive}")
+    with traced(command_name(args), "subprocess", command=command_string(args)):
+        with open(partial_archive, "wb") as archive_file:
+            result = subprocess.run(args, stdout=archive_file, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            partial_archive.unlink(missing_ok=True)
+            print_line(result.stderr.decode("utf-8", errors="replace").rstrip())
+            raise subprocess.CalledProcessError(result.returncode, command)
+        partial_archive.rename(archive)
+
+
+def load_linux_image(build: pathlib.Path, archive: pathlib.Path) -> None:
+    command = "sudo /usr/bin/docker load -q"
+    configuration = transfer_ssh_configuration(build)
+    args = ("ssh", *configuration.options(), configuration.destination(), command)
+    print_info(f"Loading the manylinux image from {archive}")
+    with traced(command_name(args), "subprocess", command=command_string(args)):
+        with open(archive, "rb") as archive_file:
+            result = subprocess.run(
+                args,
+                stdin=archive_file,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            )
+        for line in result.stdout.decode("utf-8", errors="replace").splitlines():
+            print_line(line)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, command)
+
+
+def upload_project(
+    build: pathlib.Path,
+    project: pathlib.Path,
+    guest: str,
+    incremental: bool,
+    upload: Upload,
+) -> str:
+    files = git_files(project)
+    guest_project = workspace(project) if incremental else "project"
+    method = upload.method
+    if method == "auto":
+        method = (
+            "tar"
+            if not incremental or guest_empty(build, guest, guest_project)
+            else "rsync"
+        )
+    with traced(
+        "upload",
+        "phase",
+        incremental=incremental,
+        git=files is not None,
+        method=method,
+        compression=upload.compression,
+    ):
+        if method == "tar":
+            tar_upload(
+                build,
+                project,
+                guest,
+                guest_project,
+                project_files(project),
+                upload.compression,
+                clear=not incremental,
+            )
+        elif incremental:
+            files_listing = build / f"{guest_project}.files"
+            previous_files: typing.Optional[set[str]] = None
+            if files is not None and files_listing.is_file():
+                with open(files_listing, "rb") as files_listing_file:
+                    previous_files = set(
+                        os.fsdecode(name)
+                        for name in files_listing_file.read().split(b"\0")
+                    )
+            options = (
+                "--checksum",
+                *(("--rsync-path=sudo rsync",) if guest == "linux" else ()),
+            )
+            if (
+                files is not None
+                and previous_files is not None
+                and previous_files.issubset(files)
+            ):
+                rsync(
+                    build,
+                    host_path=project,
+                    guest_path=guest_project,
+                    host_to_guest=True,
+                    options=options,
+                    files=files,
+                    compression=upload.compression,
+                )
+            else:
+                rsync(
+                    build,
+                    host_path=project,
+                    guest_path=guest_project,
+                    host_to_guest=True,
+                    options=("--delete", *options),
+                    compression=upload.compression,
+                )
+        else:
+            if guest == "linux":
+                vagrant_run(build, "sudo rm -rf project")
+            elif guest == "macos":
+                vagrant_run(build, "rm -rf project")
+            else:
+                vagrant_run(build, "if exist project rmdir /s /q project")
+            rsync(
+                build,
+                host_path=project,
+                guest_path="project",
+                host_to_guest=True,
+                files=files,
+                compression=upload.compression,
+            )
+        if incremental:
+            files_listing = build / f"{guest_project}.files"
+            if files is None:
+                files_listing.unlink(missing_ok=True)
+            else:
+                with open(files_listing, "wb") as files_listing_file:
+                    files_listing_file.write(
+                        b"\0".join(os.fsencode(name) for name in files)
+                    )
+        return guest_project
+
+
+def project_files(project: pathlib.Path) -> list[str]:
+    files = git_files(project)
+    if files is not None:
+        return files
     with tempfile.TemporaryDirectory() as temporary_directory:
-        with open(pathlib.Path(temporary_directory) / "echo.py", "wb") as echo_file:
-            base = format_info("{}")
-            echo_file.write(
-                "\n".join(
+        listing = run_process(
+            (
+                "rsync",
+                "-a",
+                "--dry-run",
+                "--out-format=%n",
+                "--filter=:- .gitignore",
+                "--exclude=.git",
+                f"{project}{os.sep}",
+                temporary_directory,
+            ),
+            check=True,
+            capture_output=True,
+            encoding="utf-8",
+        ).stdout
+    return sorted(
+        name for name in listing.split("\n") if len(name) > 0 and not name.endswith("/")
+    )
+
+
+def project_hash(project: pathlib.Path) -> str:
+    project_hash = hashlib.sha256()
+    for name in project_files(project):
+        path = project / name
+        project_hash.update(name.encode("utf-8"))
+        project_hash.update(b"\0")
+        if path.is_symlink():
+            project_hash.update(os.readlink(path).encode("utf-8"))
+        else:
+            with open(path, "rb") as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    project_hash.update(chunk)
+        project_hash.update(b"\0")
+    return project_hash.hexdigest()
+
+
+def file_hash(path: pathlib.Path) -> str:
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def copy_artifact(source: pathlib.Path, target: pathlib.Path) -> None:
+    if target.is_dir() and not target.is_symlink():
+        shutil.rmtree(target)
+    elif target.exists() or target.is_symlink():
+        target.unlink()
+    if source.is_dir() and not source.is_symlink():
+        shutil.copytree(source, target, symlinks=True)
+    else:
+        shutil.copy2(source, target, follow_symlinks=False)
+
+
+cache_lock = threading.Lock()
+
+
+class Cache:
+    def __init__(
+        self,
+        directory: typing.Optional[pathlib.Path],
+        size: int,
+        os_name: str,
+        key: dict[str, typing.Any],
+    ):
+        self.directory = directory
+        self.size = size
+        self.os_name = os_name
+        self.key = key
+
+    def entry(self, version: str) -> pathlib.Path:
+        assert self.directory is not None
+        return (
+            self.directory
+            / hashlib.sha256(
+                json.dumps(
+                    {
+                        **self.key,
+                        "os": self.os_name,
+                        "version": version,
+                        "interpreter": os_to_configuration[
+                            self.os_name
+                        ].version_to_name[version],
+                    },
+                    sort_keys=True,
+                ).encode("utf-8")
+            ).hexdigest()
+        )
+
+    def restore(
+        self, version: str, output: pathlib.Path
+    ) -> typing.Optional[list[pathlib.Path]]:
+        if self.directory is None:
+            return None
+        with traced("cache restore", "phase", version=version):
+            entry = self.entry(version)
+            artifacts: list[pathlib.Path] = []
+            with cache_lock:
+                if not (entry / "last-used").is_file():
+                    return None
+                (entry / "last-used").touch()
+                for child in sorted((entry / "artifacts").iterdir()):
+                    copy_artifact(child, output / child.name)
+                    artifacts.append(output / child.name)
+            return artifacts
+
+    def store(self, version: str, artifacts: list[pathlib.Path]) -> None:
+        if self.directory is None or len(artifacts) == 0:
+            return
+        with traced("cache store", "phase", version=version):
+            self.directory.mkdir(parents=True, exist_ok=True)
+            temporary_entry = pathlib.Path(
+                tempfile.mkdtemp(prefix=".partial-", dir=self.directory)
+            )
+            (temporary_entry / "artifacts").mkdir()
+            for artifact in artifacts:
+                copy_artifact(artifact, temporary_entry / "artifacts" / artifact.name)
+            (temporary_entry / "last-used").touch()
+            entry = self.entry(version)
+            with cache_lock:
+                shutil.rmtree(entry, ignore_errors=True)
+                temporary_entry.rename(entry)
+                self.evict()
+
+    def evict(self) -> None:
+        assert self.directory is not None
+        entries: list[tuple[float, int, pathlib.Path]] = []
+        for entry in self.directory.iterdir():
+            if entry.name.startswith(".") or not (entry / "last-used").is_file():
+                continue
+            entries.append(
+                (
+                    (entry / "last-used").stat().st_mtime,
+                    sum(
+                        path.lstat().st_size
+                        for path in entry.rglob("*")
+                        if path.is_file() or path.is_symlink()
+                    ),
+                    entry,
+                )
+            )
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total_size <= self.size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
+
+
+def wheel_coverage(artifacts: list[pathlib.Path]) -> typing.Optional[str]:
+    tags: set[packaging.tags.Tag] = set()
+    for artifact in artifacts:
+        if artifact.suffix == ".whl":
+            tags.update(packaging.utils.parse_wheel_filename(artifact.name)[3])
+    if len(tags) == 0:
+        return None
+    if all(tag.abi == "none" and tag.platform == "any" for tag in tags):
+        return "pure"
+    if all(tag.abi == "abi3" for tag in tags):
+        return "abi3"
+    return None
+
+
+class Matrix:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pure = False
+        self.abi3_os_names: set[str] = set()
+
+    def update(self, os_name: str, coverage: typing.Optional[str]) -> None:
+        with self.lock:
+            if coverage == "pure":
+                self.pure = True
+            elif coverage == "abi3":
+                self.abi3_os_names.add(os_name)
+
+    def skip(self, os_name: str) -> bool:
+        with self.lock:
+            return self.pure or os_name in self.abi3_os_names
+
+
+def guest_manifest(
+    build: pathlib.Path, os_name: str, guest_path: str
+) -> dict[str, str]:
+    python = guest_python(os_name)
+    if os_name == "linux":
+        python = f"sudo {python}"
+    path_to_hash: dict[str, str] = {}
+    for line in vagrant_output(
+        build,
+        f'{python} -c "'
+        + "import hashlib,os;"
+        + f"r='{guest_path}';"
+        + "[print(hashlib.sha256(open(p,'rb').read()).hexdigest(),os.path.relpath(p,r).replace(os.sep,'/'))"
+        + " for d,_,fs in os.walk(r) for p in (os.path.join(d,f) for f in fs) if not os.path.islink(p)]"
+        + '"',
+    ).split("\n"):
+        hash, _, path = line.rstrip("\r").partition(" ")
+        if len(path) > 0:
+            path_to_hash[path] = hash
+    return path_to_hash
+
+
+class Harvester:
+    def __init__(
+        self,
+        build: pathlib.Path,
+        os_name: str,
+        output: pathlib.Path,
+        cache: Cache,
+        matrix: Matrix,
+        versions: tuple[str, ...],
+    ):
+        self.build = build
+        self.os_name = os_name
+        self.output = output
+        self.cache = cache
+        self.matrix = matrix
+        self.versions = versions
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.futures: list[concurrent.futures.Future] = []
+        self.artifacts: list[pathlib.Path] = []
+
+    def harvest(
+        self,
+        guest_path: str,
+        version: str,
+        cached_versions: typing.Optional[tuple[str, ...]] = None,
+    ) -> None:
+        with traced("manifest", "phase", version=version):
+            path_to_hash = guest_manifest(self.build, self.os_name, guest_path)
+        coverage = wheel_coverage(
+            [pathlib.Path(path.split("/")[0]) for path in path_to_hash]
+        )
+        if coverage == "pure":
+            print_info(
+                f"Python {version} on {self.os_name} produced a pure Python wheel, skipping the remaining builds"
+            )
+        elif coverage == "abi3":
+            print_info(
+                f"Python {version} on {self.os_name} produced an abi3 wheel, skipping the remaining versions"
+            )
+        self.matrix.update(self.os_name, coverage)
+        if cached_versions is None:
+            cached_versions = (version,) if coverage is None else self.versions
+        self.futures.append(
+            self.executor.submit(
+                self.transfer,
+                guest_path,
+                version,
+                path_to_hash,
+                cached_versions,
+                output_prefix(),
+                getattr(output_state, "trace_process", None),
+            )
+        )
+
+    def transfer(
+        self,
+        guest_path: str,
+        version: str,
+        path_to_hash: dict[str, str],
+        cached_versions: tuple[str, ...],
+        prefix: typing.Optional[str],
+        process: typing.Optional[str],
+    ) -> None:
+        with prefixed_output(prefix), traced_process(process), traced(
+            "harvest", "phase", version=version
+        ):
+            staging = self.output / f".cubuzoa-{self.os_name}-{version}"
+            shutil.rmtree(staging, ignore_errors=True)
+            staging.mkdir(parents=True)
+            artifacts: list[pathlib.Path] = []
+            try:
+                rsync(
+                    self.build,
+                    host_path=staging,
+                    guest_path=guest_path,
+                    host_to_guest=False,
+                )
+                for path, hash in path_to_hash.items():
+                    if file_hash(staging / path) != hash:
+                        raise Exception(
+                            f"the checksum of {path} (Python {version} on {self.os_name}) does not match"
+                        )
+                for child in sorted(staging.iterdir()):
+                    target = self.output / child.name
+                    if target.is_dir() and not target.is_symlink():
+                        shutil.rmtree(target)
+                    os.replace(child, target)
+                    artifacts.append(target)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+            self.artifacts.extend(artifacts)
+            for cached_version in cached_versions:
+                self.cache.store(cached_version, artifacts)
+
+    def wait(self) -> None:
+        self.executor.shutdown()
+        errors = [
+            future.exception()
+            for future in self.futures
+            if future.exception() is not None
+        ]
+        for error in errors[1:]:
+            print_error(f"harvesting failed ({error})")
+        if len(errors) > 0:
+            raise typing.cast(BaseException, errors[0])
+        check_extension_modules(self.artifacts)
+
+    def __enter__(self) -> "Harvester":
+        return self
+
+    def __exit__(
+        self,
+        exception_type: typing.Optional[type[BaseException]],
+        exception: typing.Optional[BaseException],
+        traceback: typing.Any,
+    ) -> None:
+        if exception is None:
+            self.wait()
+            return
+        try:
+            self.wait()
+        except Exception as error:
+            print_error(f"harvesting failed ({error})")
+
+
+extension_module_pattern = re.compile(r"\.(cpython-[^/]+\.so|abi3\.so|pyd)$")
+
+
+def check_extension_modules(artifacts: list[pathlib.Path]) -> None:
+    hash_to_wheel: dict[str, str] = {}
+    for artifact in artifacts:
+        if artifact.suffix != ".whl":
+            continue
+        with zipfile.ZipFile(artifact) as wheel:
+            for name in wheel.namelist():
+                if extension_module_pattern.search(name) is None:
+                    continue
+                hash = hashlib.sha256(wheel.read(name)).hexdigest()
+                if hash in hash_to_wheel and hash_to_wheel[hash] != artifact.name:
+                    raise Exception(
+                        f"{artifact.name} and {hash_to_wheel[hash]} contain the same extension module ({name}), concurrent builds probably overwrote each other's outputs"
+                    )
+                hash_to_wheel[hash] = artifact.name
+
+
+def run_os_provision(
+    os_name: str,
+    build: pathlib.Path,
+    os_provision: typing.Callable[[], None],
+    machine_slots: threading.Semaphore,
+    suspend: bool,
+    wheelhouse_requirements: list[str],
+) -> None:
+    vagrant_add(os_to_configuration[os_name].box)
+    set_status("waiting for a machine slot")
+    with machine_slots:
+        os_provision()
+        refresh_wheelhouse(build, os_name, wheelhouse_requirements)
+        take_snapshot(build)
+        if suspend:
+            vagrant_suspend(build)
+
+
+def run_os_build(
+    os_name: str,
+    build: pathlib.Path,
+    builds: list[tuple[str, Matrix, typing.Callable[[], None]]],
+    reset: str,
+    suspend: bool,
+    idle_ttl: typing.Optional[float],
+) -> None:
+    if all(matrix.pure for _, matrix, _ in builds):
+        print_info(f"Skipping {os_name}, a pure Python wheel has already been built")
+        return
+    with guest_lock(build), guest_in_use(build, idle_ttl):
+        try:
+            if reset == "snapshot":
+                restore_snapshot(build)
+            wake_guest(build)
+            rsync_utilities(build, os_name)
+            failed_names: list[str] = []
+            with (
+                linux_container(build)
+                if os_name == "linux"
+                else contextlib.nullcontext()
+            ):
+                for name, matrix, os_build in builds:
+                    if matrix.pure:
+                        print_info(
+                            f"Skipping {name}, a pure Python wheel has already been built"
+                        )
+                        continue
+                    if len(builds) == 1:
+                        os_build()
+                        continue
+                    print_info(f"Building {name}")
+                    with traced(name, "project"):
+                        try:
+                            os_build()
+                        except (Exception, SystemExit) as error:
+                            print_error(f"{name} failed ({error})")
+                            failed_names.append(name)
+            if len(failed_names) > 0:
+                raise Exception(f"{', '.join(failed_names)} failed")
+        finally:
+            if suspend:
+                vagrant_suspend(build)
+
+
+def unix_workspaces(
+    build: pathlib.Path,
+    os_name: str,
+    guest_project: str,
+    versions: tuple[str, ...],
+    jobs: int,
+    incremental: bool,
+) -> dict[str, str]:
+    sudo = "sudo " if os_name == "linux" else ""
+    with traced("workspaces", "phase", incremental=incremental):
+        if jobs <= 1 or len(versions) <= 1:
+            return {version: guest_project for version in versions}
+        version_to_workspace = {
+            version: f"workspaces/{guest_project}/{version}" for version in versions
+        }
+        if incremental:
+            vagrant_run(
+                build,
+                " && ".join(
+                    f"{sudo}mkdir -p {workspace} && {sudo}rsync -a --delete --filter=':- .gitignore' --exclude=.git {guest_project}/ {workspace}/"
+                    for workspace in version_to_workspace.values()
+                ),
+            )
+        else:
+            vagrant_run(
+                build,
+                " && ".join(
                     (
-                        "import sys",
-                        "if len(sys.argv) > 1:",
-                        "    sys.stdout.reconfigure(encoding='utf-8')",
-                        f"    print('{base}'.format(' '.join(sys.argv[1:])))",
+                        f"{sudo}rm -rf workspaces/{guest_project}",
+                        f"mkdir -p workspaces/{guest_project}",
+                        *(
+                            f"cp -a {guest_project} {workspace}"
+                            for workspace in version_to_workspace.values()
+                        ),
                     )
-                ).encode("utf-8")
+                ),
+            )
+        return version_to_workspace
+
+
+windows_architectures = ("x64", "x86")
+windows_architecture_to_rust_target = {
+    "x64": "x86_64-pc-windows-msvc",
+    "x86": "i686-pc-windows-msvc",
+}
+
+
+def windows_python(version: str, architecture: str) -> str:
+    if architecture == "x64":
+        return '"C:\\Program Files\\Python{}\\python.exe"'.format(
+            version.replace(".", "")
+        )
+    return '"C:\\Program Files (x86)\\Python{}-32\\python.exe"'.format(
+        version.replace(".", "")
+    )
+
+
+def windows_version_string(version: str, architecture: str) -> str:
+    return version if architecture == "x64" else f"{version} (32 bits)"
+
+
+def windows_workspaces(
+    build: pathlib.Path,
+    guest_project: str,
+    versions: tuple[str, ...],
+    jobs: int,
+    incremental: bool,
+) -> dict[tuple[str, str], str]:
+    targets = [
+        (version, architecture)
+        for version in versions
+        for architecture in windows_architectures
+    ]
+    with traced("workspaces", "phase", incremental=incremental):
+        if jobs <= 1:
+            return {target: guest_project for target in targets}
+        target_to_workspace = {
+            (
+                version,
+                architecture,
+            ): f"workspaces\\{guest_project}\\{version}-{architecture}"
+            for version, architecture in targets
+        }
+        if incremental:
+            vagrant_run(
+                build,
+                " && ".join(
+                    '(if not exist {0} mkdir {0}) && rsync -rlt --delete --filter=":- .gitignore" --exclude=.git {1}/ {2}/'.format(
+                        workspace, guest_project, workspace.replace("\\", "/")
+                    )
+                    for workspace in target_to_workspace.values()
+                ),
+            )
+        else:
+            vagrant_run(
+                build,
+                f"rmdir /s /q workspaces\\{guest_project} 2>nul & "
+                + " && ".join(
+                    f"xcopy {guest_project} {workspace}\\ /e /i /q /h /y >nul"
+                    for workspace in target_to_workspace.values()
+                ),
+            )
+        return target_to_workspace
+
+
+def workspace_home(os_name: str, workspace: str) -> str:
+    separator = "\\" if os_name == "windows" else "/"
+    return f"..{separator}" * (workspace.count(separator) + 1)
+
+
+def run_windows_targets(
+    function: typing.Callable[[str, str], None],
+    versions: tuple[str, ...],
+    jobs: int,
+    matrix: Matrix,
+    harvest: typing.Callable[[str], None],
+) -> None:
+    if jobs <= 1:
+        for version in versions:
+            if matrix.skip("windows"):
+                break
+            for architecture in windows_architectures:
+                function(version, architecture)
+            harvest(version)
+        return
+    name_to_target = {
+        windows_version_string(version, architecture): (version, architecture)
+        for version in versions
+        for architecture in windows_architectures
+    }
+
+    def run_target(name: str) -> None:
+        if not matrix.skip("windows"):
+            function(*name_to_target[name])
+
+    outcomes = run_tasks(
+        [(name, functools.partial(run_target, name)) for name in name_to_target],
+        jobs=jobs,
+    )
+    failed_names = [outcome.name for outcome in outcomes if not outcome.succeeded()]
+    failed_versions = set(name_to_target[name][0] for name in failed_names)
+    for version in versions:
+        if version not in failed_versions:
+            harvest(version)
+    if len(failed_names) > 0:
+        raise Exception(
+            f"the build failed for Python {versions_to_string(failed_names)}"
+        )
+
+
+def maturin_environment(
+    os_name: str,
+    project: pathlib.Path,
+    target: str,
+    version: typing.Optional[str],
+    compiler_cache: typing.Optional[float],
+) -> dict[str, str]:
+    caches = "/caches" if os_name == "linux" else os_to_guest_caches[os_name]
+    environment = {
+        "CARGO_TARGET_DIR": guest_path(
+            os_name,
+            caches,
+            "cargo-target",
+            workspace(project),
+            target,
+            *(() if version is None else (version,)),
+        )
+    }
+    if compiler_cache is not None:
+        environment["RUSTC_WRAPPER"] = os_to_sccache[os_name]
+        environment["SCCACHE_DIR"] = guest_path(os_name, caches, "sccache")
+        environment["SCCACHE_CACHE_SIZE"] = f"{round(compiler_cache * 1000)}M"
+    return environment
+
+
+def ccache_environment(os_name: str, compiler_cache: float) -> dict[str, str]:
+    caches = "/caches" if os_name == "linux" else os_to_guest_caches[os_name]
+    environment = {
+        "CCACHE_DIR": guest_path(os_name, caches, "ccache"),
+        "CCACHE_MAXSIZE": f"{round(compiler_cache * 1000)}M",
+    }
+    if os_name == "linux":
+        environment["CC"] = "ccache gcc"
+        environment["CXX"] = "ccache g++"
+    elif os_name == "macos":
+        environment["CC"] = f"{os_to_ccache['macos']} clang"
+        environment["CXX"] = f"{os_to_ccache['macos']} clang++"
+    else:
+        environment["DISTUTILS_USE_SDK"] = "1"
+        environment["MSSdk"] = "1"
+    return environment
+
+
+def ccache(
+    build: pathlib.Path, os_name: str, compiler_cache: float, option: str
+) -> None:
+    agent_run(
+        build,
+        os_name,
+        (Step("ccache", f"{os_to_ccache[os_name]} {option}"),),
+        environment=ccache_environment(os_name, compiler_cache),
+        name="ccache",
+    )
+
+
+def guest_caches(build: pathlib.Path, os_name: str, prune: bool) -> dict[str, int]:
+    root = os_to_guest_caches[os_name].replace("\\", "/")
+    python = guest_python(os_name)
+    if os_name == "linux":
+        python = f"sudo {python}"
+    name_to_size: dict[str, int] = {}
+    for line in vagrant_output(
+        build,
+        f'{python} -c "'
+        + "import os;"
+        + f"r='{root}';"
+        + "[print(n,sum(os.lstat(os.path.join(d,f)).st_size for d,_,fs in os.walk(os.path.join(r,n)) for f in fs))"
+        + " for n in (sorted(os.listdir(r)) if os.path.isdir(r) else [])]"
+        + '"',
+    ).split("\n"):
+        name, _, size = line.strip().rpartition(" ")
+        if len(name) > 0:
+            name_to_size[name] = int(size)
+    if prune:
+        vagrant_run(
+            build,
+            f"{python} -c \"import shutil;shutil.rmtree('{root}',ignore_errors=True)\"",
+        )
+    return name_to_size
+
+
+default_wheelhouse_requirements = ("setuptools", "wheel", "Cython", "numpy")
+
+
+def read_wheelhouse_requirements(path: typing.Optional[pathlib.Path]) -> list[str]:
+    if path is None:
+        return list(default_wheelhouse_requirements)
+    requirements: list[str] = []
+    with open(path, encoding="utf-8") as requirements_file:
+        for line in requirements_file:
+            requirement = line.partition("#")[0].strip()
+            if len(requirement) > 0:
+                packaging.requirements.Requirement(requirement)
+                requirements.append(requirement)
+    return requirements
+
+
+def guest_wheelhouse(os_name: str) -> str:
+    if os_name == "linux":
+        return "/caches/wheelhouse"
+    return guest_path(os_name, os_to_guest_caches[os_name], "wheelhouse")
+
+
+def wheelhouse_target(version: str, architecture: typing.Optional[str] = None) -> str:
+    return version if architecture is None else f"{version}-{architecture}"
+
+
+def guest_interpreters(os_name: str) -> list[tuple[str, str, str]]:
+    configuration = os_to_configuration[os_name]
+    if os_name == "linux":
+        return [
+            (version, version, f"{configuration.version_to_name[version]}/python")
+            for version in configuration.versions()
+        ]
+    if os_name == "macos":
+        return [
+            (version, version, macos_python(version))
+            for version in configuration.versions()
+        ]
+    return [
+        (
+            windows_version_string(version, architecture),
+            wheelhouse_target(version, architecture),
+            windows_python(version, architecture).strip('"'),
+        )
+        for version in configuration.versions()
+        for architecture in windows_architectures
+    ]
+
+
+def refresh_wheelhouse(
+    build: pathlib.Path, os_name: str, requirements: list[str]
+) -> None:
+    wheelhouse = guest_wheelhouse(os_name)
+    with traced("wheelhouse", "phase", requirements=len(requirements)):
+        print_info(
+            f"Filling the {os_name} wheelhouse with {versions_to_string(requirements)}"
+        )
+        rsync_utilities(build, os_name)
+        interpreters = guest_interpreters(os_name)
+        jobs = min(len(interpreters), guest_cpus(build))
+        agent_run(
+            build,
+            os_name,
+            (
+                Step(
+                    "clear",
+                    [
+                        interpreters[0][2],
+                        "-c",
+                        "import shutil, sys; shutil.rmtree(sys.argv[1], ignore_errors=True)",
+                        wheelhouse,
+                    ],
+                ),
+                *(
+                    Step(
+                        f"wheel {name}",
+                        [
+                            python,
+                            "-m",
+                            "pip",
+                            "wheel",
+                            "--wheel-dir",
+                            guest_path(os_name, wheelhouse, target),
+                            *requirements,
+                        ],
+                        description=f"Downloading wheels for Python {name}",
+                        needs=["clear"],
+                    )
+                    for name, target, python in interpreters
+                ),
+            ),
+            jobs=jobs,
+            concurrency=jobs,
+            name="wheelhouse",
+        )
+        target_to_wheels: dict[str, list[str]] = {}
+        for path in guest_manifest(
+            build,
+            os_name,
+            guest_path(os_name, os_to_guest_caches[os_name], "wheelhouse"),
+        ):
+            target, _, filename = path.partition("/")
+            if filename.endswith(".whl"):
+                target_to_wheels.setdefault(target, []).append(filename)
+        with open(build / "wheelhouse.json", "w") as wheelhouse_file:
+            json.dump(
+                {"requirements": requirements, "wheels": target_to_wheels},
+                wheelhouse_file,
+            )
+
+
+def read_wheelhouse(build: pathlib.Path) -> typing.Optional[dict[str, typing.Any]]:
+    if not (build / "wheelhouse.json").is_file():
+        return None
+    with open(build / "wheelhouse.json") as wheelhouse_file:
+        return json.load(wheelhouse_file)
+
+
+def wheelhouse_requirements(build: pathlib.Path) -> typing.Optional[list[str]]:
+    wheelhouse = read_wheelhouse(build)
+    return None if wheelhouse is None else wheelhouse["requirements"]
+
+
+def marker_environment(
+    os_name: str, version: str, architecture: typing.Optional[str]
+) -> dict[str, str]:
+    full_version = (
+        version
+        if os_name == "linux"
+        else os_to_configuration[os_name].version_to_name[version]
+    )
+    if os_name == "linux":
+        platform = ("linux", "Linux", "x86_64")
+    elif os_name == "macos":
+        platform = ("darwin", "Darwin", "x86_64")
+    else:
+        platform = ("win32", "Windows", "AMD64" if architecture == "x64" else "x86")
+    return {
+        "implementation_name": "cpython",
+        "implementation_version": full_version,
+        "os_name": "nt" if os_name == "windows" else "posix",
+        "platform_machine": platform[2],
+        "platform_python_implementation": "CPython",
+        "platform_system": platform[1],
+        "python_full_version": full_version,
+        "python_version": version,
+        "sys_platform": platform[0],
+    }
+
+
+def wheelhouse_satisfies(
+    wheelhouse: dict[str, typing.Any],
+    os_name: str,
+    version: str,
+    architecture: typing.Optional[str],
+    requirements: list[str],
+) -> bool:
+    name_to_versions: dict[str, list[packaging.version.Version]] = {}
+    for filename in wheelhouse["wheels"].get(
+        wheelhouse_target(version, architecture), []
+    ):
+        name, wheel_version, _, _ = packaging.utils.parse_wheel_filename(filename)
+        name_to_versions.setdefault(name, []).append(wheel_version)
+    name_to_extras: dict[str, set[str]] = {}
+    for requirement in wheelhouse["requirements"]:
+        parsed_requirement = packaging.requirements.Requirement(requirement)
+        name_to_extras.setdefault(
+            packaging.utils.canonicalize_name(parsed_requirement.name), set()
+        ).update(parsed_requirement.extras)
+    environment = marker_environment(os_name, version, architecture)
+    for requirement in requirements:
+        parsed_requirement = packaging.requirements.Requirement(requirement)
+        if (
+            parsed_requirement.marker is not None
+            and not parsed_requirement.marker.evaluate(environment)
+        ):
+            continue
+        name = packaging.utils.canonicalize_name(parsed_requirement.name)
+        if not parsed_requirement.extras.issubset(name_to_extras.get(name, set())):
+            return False
+        if not any(
+            parsed_requirement.specifier.contains(wheel_version, prereleases=True)
+            for wheel_version in name_to_versions.get(name, [])
+        ):
+            return False
+    return True
+
+
+def wheelhouse_environment(
+    build: pathlib.Path,
+    os_name: str,
+    pyproject: dict[str, typing.Any],
+    version: str,
+    architecture: typing.Optional[str] = None,
+) -> dict[str, str]:
+    wheelhouse = read_wheelhouse(build)
+    if wheelhouse is None or not "wheels" in wheelhouse:
+        return {}
+    environment = {
+        "PIP_FIND_LINKS": guest_path(
+            os_name,
+            guest_wheelhouse(os_name),
+            wheelhouse_target(version, architecture),
+        )
+    }
+    if wheelhouse_satisfies(
+        wheelhouse,
+        os_name,
+        version,
+        architecture,
+        pyproject["build-system"]["requires"],
+    ):
+        environment["PIP_NO_INDEX"] = "1"
+    return environment
+
+
+linux_container_name = "cubuzoa"
+linux_container_volumes = (
+    "-v ~:/guest",
+    "-v ~/wheels:/wheels",
+    "-v ~/build:/build",
+    "-v ~/caches:/caches",
+    "-v ~/utilities:/utilities:ro",
+)
+build_to_container: dict[pathlib.Path, str] = {}
+
+
+@contextlib.contextmanager
+def linux_container(build: pathlib.Path) -> typing.Iterator[None]:
+    # the guest directories are reached through the home mount, so that the backends can replace them
+    links = " && ".join(
+        (
+            "rm -rf /wheels /build /caches /utilities",
+            *(
+                f"ln -s /guest/{name} /{name}"
+                for name in ("wheels", "build", "caches", "utilities")
+            ),
+        )
+    )
+    with traced("container start", "phase"):
+        vagrant_run(
+            build,
+            " && ".join(
+                (
+                    f"(sudo /usr/bin/docker rm -f {linux_container_name} >/dev/null 2>&1; true)",
+                    "mkdir -p wheels build caches utilities",
+                    f"sudo /usr/bin/docker run -d --init --name {linux_container_name} -v ~:/guest manylinux sleep infinity >/dev/null",
+                    f"sudo /usr/bin/docker exec {linux_container_name} /bin/bash -c '{links}'",
+                )
+            ),
+        )
+    build_to_container[build] = linux_container_name
+    try:
+        yield
+    finally:
+        del build_to_container[build]
+        with traced("container stop", "phase"):
+            vagrant_run(
+                build, f"sudo /usr/bin/docker rm -f {linux_container_name} >/dev/null"
+            )
+
+
+def linux_docker_run(
+    build: pathlib.Path,
+    command: str,
+    project: typing.Optional[str] = None,
+    handle_line: typing.Optional[typing.Callable[[str], None]] = None,
+) -> None:
+    workdir = () if project is None else (f"-w /guest/{project}",)
+    if build in build_to_container:
+        arguments: tuple[str, ...] = (
+            "sudo /usr/bin/docker exec",
+            *workdir,
+            build_to_container[build],
+        )
+    else:
+        arguments = (
+            "sudo /usr/bin/docker run",
+            "--rm",
+            *linux_container_volumes,
+            *workdir,
+            "manylinux",
+        )
+    vagrant_run(build, " ".join((*arguments, command)), handle_line=handle_line)
+
+
+agent_marker = "cubuzoa-agent:"
+
+
+class Step:
+    def __init__(
+        self,
+        name: str,
+        command: typing.Union[str, typing.Sequence[str]],
+        description: typing.Optional[str] = None,
+        cwd: typing.Optional[str] = None,
+        environment: typing.Optional[dict[str, str]] = None,
+        needs: typing.Optional[typing.Sequence[str]] = None,
+    ):
+        self.name = name
+        self.command = command
+        self.description = description
+        self.cwd = cwd
+        self.environment = environment
+        self.needs = needs
+
+    def to_json(self) -> dict[str, typing.Any]:
+        step: dict[str, typing.Any] = {
+            "name": self.name,
+            "command": self.command
+            if isinstance(self.command, str)
+            else list(self.command),
+        }
+        if self.cwd is not None:
+            step["cwd"] = self.cwd
+        if self.environment is not None:
+            step["env"] = self.environment
+        if self.needs is not None:
+            step["needs"] = list(self.needs)
+        return step
+
+
+class StepResult:
+    def __init__(self, name: str, returncode: typing.Optional[int], duration: float):
+        self.name = name
+        self.returncode = returncode
+        self.duration = duration
+
+    def skipped(self) -> bool:
+        return self.returncode is None
+
+
+class AgentReport:
+    def __init__(self, steps: typing.Sequence[Step]):
+        self.name_to_description = {step.name: step.description for step in steps}
+        self.name_to_begin: dict[str, float] = {}
+        self.results: list[StepResult] = []
+
+    def handle_line(self, line: str) -> None:
+        _, found, event = line.partition(agent_marker)
+        if len(found) == 0:
+            print_line(line)
+            return
+        fields = json.loads(event)
+        if fields["event"] == "start":
+            self.name_to_begin[fields["step"]] = time.monotonic()
+            description = self.name_to_description.get(fields["step"])
+            if description is not None:
+                print_info(description)
+        elif fields["event"] == "end":
+            self.results.append(
+                StepResult(fields["step"], fields["returncode"], fields["duration"])
             )
+            if trace is not None:
+                trace.add(
+                    fields["step"],
+                    "step",
+                    self.name_to_begin[fields["step"]],
+                    time.monotonic(),
+                    {
+                        "exit code": fields["returncode"],
+                        "guest duration": fields["duration"],
+                    },
+                )
+        else:
+            self.results.append(StepResult(fields["step"], None, 0.0))
+
+    def failed(self) -> typing.Optional[StepResult]:
+        for result in self.results:
+            if not result.skipped() and result.returncode != 0:
+                return result
+        return None
+
+
+def agent_run(
+    build: pathlib.Path,
+    os_name: str,
+    steps: typing.Sequence[Step],
+    cwd: typing.Optional[str] = None,
+    environment: typing.Optional[dict[str, str]] = None,
+    jobs: int = 1,
+    concurrency: int = 1,
+    project: typing.Optional[str] = None,
+    name: str = "job",
+) -> list[StepResult]:
+    job: dict[str, typing.Any] = {
+        "steps": [step.to_json() for step in steps],
+        "env": {
+            **parallelism_environment(build, os_name, concurrency),
+            **({} if environment is None else environment),
+        },
+        "jobs": jobs,
+    }
+    if cwd is not None:
+        job["cwd"] = cwd
+    if os_name == "linux":
+        job["shell"] = ["/bin/bash", "-c"]
+        job["env"] = {"BASH_ENV": "/root/.profile", **job["env"]}
+    payload = base64.b64encode(
+        zlib.compress(json.dumps(job).encode("utf-8"), 9)
+    ).decode("ascii")
+    report = AgentReport(steps)
+    try:
+        with traced(name, "job"):
+            if os_name == "linux":
+                linux_docker_run(
+                    build,
+                    "{}/python /utilities/agent.py {}".format(
+                        os_to_configuration["linux"].default_name(), payload
+                    ),
+                    project=project,
+                    handle_line=report.handle_line,
+                )
+            else:
+                vagrant_run(
+                    build,
+                    "{} {} {}".format(
+                        guest_python(os_name),
+                        guest_path(os_name, "utilities", "agent.py"),
+                        payload,
+                    ),
+                    handle_line=report.handle_line,
+                )
+    except subprocess.CalledProcessError:
+        failed = report.failed()
+        if failed is None:
+            raise
+        raise Exception(
+            f'the step "{failed.name}" failed with exit code {failed.returncode}'
+        ) from None
+    return report.results
+
+
+def rsync_utilities(build: pathlib.Path, os_name: str) -> None:
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        shutil.copy2(
+            dirname / "agent.py", pathlib.Path(temporary_directory) / "agent.py"
+        )
+        if os_name == "windows":
+            with open(
+                pathlib.Path(temporary_directory) / "msvc-ccache.bat", "wb"
+            ) as msvc_ccache_file:
+                msvc_ccache_file.write(
+                    "\r\n".join(
+                        (
+                            "@echo off",
+                            'call "C:\\Program Files (x86)\\Microsoft Visual Studio\\2019\\BuildTools\\VC\\Auxiliary\\Build\\vcvarsall.bat" %1 >nul',
+                            'set "PATH=C:\\Users\\vagrant\\ccache-bin;%PATH%"',
+                        )
+                    ).encode("utf-8")
+                )
         rsync(
             build,
             host_path=pathlib.Path(temporary_directory),
@@ -305,20 +2573,13 @@ def pip_uninstall(wheel: str) -> str:
 
 
 def pip_install_pyproject(pyproject: dict[str, typing.Any], guest: str) -> str:
-    if guest == "macos":
+    if guest == "macos" or guest == "linux":
         return pip_install(
             " ".join(
                 '"{}"'.format(package.replace(" ", ""))
                 for package in pyproject["build-system"]["requires"]
             )
         )
-    elif guest == "linux":
-        return pip_install(
-            " ".join(
-                '"{}"'.format(package.replace(" ", "").replace("'", "\\'"))
-                for package in pyproject["build-system"]["requires"]
-            )
-        )
     return pip_install(
         " ".join(
             package.replace(" ", "")
@@ -327,6 +2588,23 @@ def pip_install_pyproject(pyproject: dict[str, typing.Any], guest: str) -> str:
     )
 
 
+def macos_install_requirements(pyproject: dict[str, typing.Any], version: str) -> str:
+    stamp = "$HOME/.cubuzoa/requirements/{}-{}".format(
+        os_to_configuration["macos"].version_to_name[version],
+        hashlib.sha256(
+            json.dumps(sorted(pyproject["build-system"]["requires"])).encode("utf-8")
+        ).hexdigest()[:16],
+    )
+    return " || ".join(
+        (
+            f"test -f {stamp}",
+            "({} {} && mkdir -p $HOME/.cubuzoa/requirements && touch {})".format(
+                macos_python(version), pip_install_pyproject(pyproject, "macos"), stamp
+            ),
+        )
+    )
+
+
 def pyinstaller(
     project: pathlib.Path,
     target: str,
@@ -373,7 +2651,7 @@ def pyinstaller(
         )
     if guest == "macos":
         extra_arguments += " --upx-dir /usr/local/bin"
-    print(
+    print_line(
         "-m PyInstaller{} --distpath {} -n {}-cp{}-{} {}".format(
             extra_arguments,
             target,
@@ -1,36 +1,51 @@
 from cubuzoa import common
+import hashlib
 import pathlib
+import subprocess
+import typing
 
 
-def os_provision(build: pathlib.Path):
+def dockerfile() -> str:
+    configuration = common.os_to_configuration["linux"]
+    return "\n".join(
+        (
+            "FROM quay.io/pypa/manylinux2014_x86_64",
+            "ENV USER root",
+            "RUN mkdir /project",
+            "RUN mkdir /wheels",
+            "RUN mkdir /build",
+            "RUN curl --proto '=https' --tlsv1.2 -sSf https://sh.rustup.rs | sh -s -- -y",
+            "RUN /root/.cargo/bin/cargo install sccache --locked",
+            "RUN {}/pip3 install cffi".format(configuration.default_name()),
+            "RUN {}/pip3 install maturin".format(configuration.default_name()),
+            "RUN yum -y install upx",
+            "RUN yum -y install epel-release && yum -y install ccache",
+            "RUN yum -y install centos-release-scl-rh",
+            "RUN yum -y install rh-python38-python-devel",
+            "RUN yum -y install rh-python38-python-pip",
+            "RUN /bin/bash -c 'source /opt/rh/rh-python38/enable; pip3 install pyinstaller'",
+            "WORKDIR /project",
+        )
+    )
+
+
+def image_key() -> str:
+    return hashlib.sha256(dockerfile().encode("utf-8")).hexdigest()[:16]
+
+
+def os_provision(build: pathlib.Path, image_cache: typing.Optional[pathlib.Path]):
     configuration = common.os_to_configuration["linux"]
     common.print_info(
         f"Installing Linux with Python versions {common.versions_to_string(configuration.versions())}"
     )
     common.vagrant_destroy(build)
-    common.vagrant_add(configuration.box)
     build.mkdir(exist_ok=True)
-    with open(build / "Dockerfile", "w") as dockerfile:
-        dockerfile.write(
-            "\n".join(
-                (
-                    "FROM quay.io/pypa/manylinux2014_x86_64",
-                    "ENV USER root",
-                    "RUN mkdir /project",
-                    "RUN mkdir /wheels",
-                    "RUN mkdir /build",
-                    "RUN curl --proto '=https' --tlsv1.2 -sSf https://sh.rustup.rs | sh -s -- -y",
-                    "RUN {}/pip3 install cffi".format(configuration.default_name()),
-                    "RUN {}/pip3 install maturin".format(configuration.default_name()),
-                    "RUN yum -y install upx",
-                    "RUN yum -y install centos-release-scl-rh",
-                    "RUN yum -y install rh-python38-python-devel",
-                    "RUN yum -y install rh-python38-python-pip",
-                    "RUN /bin/bash -c 'source /opt/rh/rh-python38/enable; pip3 install pyinstaller'",
-                    "WORKDIR /project",
-                )
-            )
-        )
+    archive = (
+        None if image_cache is None else common.image_archive(image_cache, image_key())
+    )
+    cached = archive is not None and archive.is_file()
+    with open(build / "Dockerfile", "w") as dockerfile_file:
+        dockerfile_file.write(dockerfile())
     with open(build / "Vagrantfile", "w") as vagrantfile:
         vagrantfile.write(
             "\n".join(
@@ -41,9 +56,16 @@ def os_provision(build: pathlib.Path):
                     "    apt-get update -qq -o=Dpkg::Use-Pty=0 > /dev/null",
                     "    apt-get install -qq -o=Dpkg::Use-Pty=0 docker.io > /dev/null 2>&1",
                     "    usermod -aG docker vagrant",
-                    "    printf 'Downloading manylinux\\n'",
-                    "    docker build manylinux -t manylinux -q --rm",
+                    *(
+                        ()
+                        if cached
+                        else (
+                            "    printf 'Downloading manylinux\\n'",
+                            "    docker build manylinux -t manylinux -q --rm",
+                        )
+                    ),
                     "SCRIPT",
+                    'require "json"',
                     'Vagrant.configure("2") do |config|',
                     '    config.vm.box = "{}"'.format(configuration.box),
                     '    config.vm.synced_folder ".", "/vagrant", disabled: true',
@@ -54,7 +76,7 @@ def os_provision(build: pathlib.Path):
                     '    config.vm.provider "virtualbox" do |v|',
                     '        v.name = "{}"'.format(common.box_name("linux")),
                     "        v.check_guest_additions = false",
-                    "        v.memory = 2048",
+                    *common.vagrantfile_resources(),
                     "    end",
                     "    config.ssh.insert_key = false",
                     "end",
@@ -62,3 +84,17 @@ def os_provision(build: pathlib.Path):
             )
         )
     common.vagrant_up(build)
+    if archive is not None:
+        if cached:
+            try:
+                common.load_linux_image(build, archive)
+                return
+            except (OSError, subprocess.CalledProcessError) as error:
+                common.print_warning(
+                    f"loading {archive} failed ({error}), building the image instead"
+                )
+                common.print_info("Downloading manylinux")
+                common.vagrant_run(
+                    build, "sudo docker build manylinux -t manylinux -q --rm"
+                )
+        common.save_linux_image(build, archive)
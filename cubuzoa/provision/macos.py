@@ -8,7 +8,6 @@ def os_provision(build: pathlib.Path):
         f"Installing macOS with Python {common.versions_to_string(configuration.versions())}"
     )
     common.vagrant_destroy(build)
-    common.vagrant_add(configuration.box)
     build.mkdir(exist_ok=True)
     with open(build / "Vagrantfile", "w") as vagrantfile:
         vagrantfile.write(
@@ -34,6 +33,8 @@ def os_provision(build: pathlib.Path):
                     "source $HOME/.cargo/env",
                     "rustup target add aarch64-apple-darwin x86_64-apple-darwin",
                     "brew install upx",
+                    "brew install sccache",
+                    "brew install ccache",
                     *(
                         "\n".join(
                             (
@@ -46,6 +47,7 @@ def os_provision(build: pathlib.Path):
                     "pyenv local {}".format(configuration.default_name()),
                     "pyenv exec python3 -m pip install maturin",
                     "SCRIPT",
+                    'require "json"',
                     'Vagrant.configure("2") do |config|',
                     '    config.vm.box = "{}"'.format(configuration.box),
                     '    config.vm.synced_folder ".", "/vagrant", disabled: true',
@@ -53,6 +55,7 @@ def os_provision(build: pathlib.Path):
                     '    config.vm.provider "virtualbox" do |v|',
                     '        v.name = "{}"'.format(common.box_name("macos")),
                     "        v.check_guest_additions = false",
+                    *common.vagrantfile_resources(),
                     "    end",
                     "    config.ssh.insert_key = false",
                     '    config.trigger.after :"VagrantPlugins::ProviderVirtualBox::Action::Import", type: :action do |t|',
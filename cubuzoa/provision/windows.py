@@ -8,7 +8,6 @@ def os_provision(build: pathlib.Path):
         f"Installing Windows with Python {common.versions_to_string(configuration.versions())}"
     )
     common.vagrant_destroy(build)
-    common.vagrant_add(configuration.box)
     build.mkdir(exist_ok=True)
     with open(build / "Vagrantfile", "w") as vagrantfile:
         vagrantfile.write(
@@ -53,12 +52,18 @@ def os_provision(build: pathlib.Path):
                     "choco install visualstudio2019buildtools -y",
                     "choco install visualstudio2019-workload-vctools -y",
                     "choco install upx -y",
+                    "choco install ccache -y",
+                    "New-Item -ItemType Directory -Force -Path C:\\Users\\vagrant\\ccache-bin | Out-Null",
+                    "Copy-Item `",
+                    "    (Get-ChildItem -Recurse -Filter ccache.exe C:\\ProgramData\\chocolatey\\lib\\ccache | Select-Object -First 1).FullName `",
+                    "    C:\\Users\\vagrant\\ccache-bin\\cl.exe",
                     "Invoke-WebRequest `",
                     '    -URI "https://win.rustup.rs/x86_64" `',
                     '    -OutFile "C:\\Users\\vagrant\\rustup-init.exe" `',
                     "    -UseBasicParsing",
                     "C:\\Users\\vagrant\\rustup-init.exe -y",
                     "C:\\Users\\vagrant\\.cargo\\bin\\rustup.exe target add i686-pc-windows-msvc",
+                    "C:\\Users\\vagrant\\.cargo\\bin\\cargo.exe install sccache --locked",
                     '& "C:\\Program Files\\Python{}\\Scripts\\pip3.exe" install maturin'.format(
                         configuration.default_version().replace(".", "")
                     ),
@@ -76,6 +81,7 @@ def os_provision(build: pathlib.Path):
                     ),
                     "choco install rsync -y",
                     "SCRIPT",
+                    'require "json"',
                     'Vagrant.configure("2") do |config|',
                     '    config.vm.box = "{}"'.format(configuration.box),
                     '    config.vm.synced_folder ".", "/vagrant", disabled: true',
@@ -83,6 +89,7 @@ def os_provision(build: pathlib.Path):
                     '    config.vm.provider "virtualbox" do |v|',
                     '        v.name = "{}"'.format(common.box_name("windows")),
                     "        v.check_guest_additions = false",
+                    *common.vagrantfile_resources(),
                     "    end",
                     "    config.ssh.insert_key = false",
                     "end",
@@ -0,0 +1,292 @@
+import argparse
+import json
+import os
+import pathlib
+import re
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+import typing
+from . import common
+
+dirname = pathlib.Path(__file__).resolve().parent
+
+
+class Job:
+    def __init__(
+        self,
+        identifier: int,
+        cwd: str,
+        project: str,
+        arguments: list[str],
+        os_names: set[str],
+        connection: socket.socket,
+    ):
+        self.identifier = identifier
+        self.cwd = cwd
+        self.project = project
+        self.arguments = arguments
+        self.os_names = os_names
+        self.connection = connection
+        self.connection_lock = threading.Lock()
+        self.process: typing.Optional[subprocess.Popen] = None
+        self.cancelled = False
+        self.done = threading.Event()
+
+    def name(self) -> str:
+        return f"job {self.identifier} ({self.project} on {', '.join(sorted(self.os_names))})"
+
+    def send(self, message: dict[str, typing.Any]) -> None:
+        with self.connection_lock:
+            try:
+                self.connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+            except OSError:
+                pass
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path: pathlib.Path,
+        build: pathlib.Path,
+        jobs: int,
+        parse_build_arguments: typing.Callable[[list[str]], argparse.Namespace],
+    ):
+        self.build = build
+        self.jobs = max(1, jobs)
+        self.parse_build_arguments = parse_build_arguments
+        self.lock = threading.Lock()
+        self.queue: list[Job] = []
+        self.running: list[Job] = []
+        self.next_identifier = 1
+        super().__init__(str(socket_path), Handler)
+
+    def add(
+        self, cwd: str, arguments: list[str], connection: socket.socket
+    ) -> typing.Optional[Job]:
+        try:
+            build_arguments = self.parse_build_arguments(arguments)
+        except SystemExit:
+            return None
+        os_regex = re.compile(build_arguments.os, re.IGNORECASE)
+        with self.lock:
+            job = Job(
+                identifier=self.next_identifier,
+                cwd=cwd,
+                project=", ".join(
+                    (
+                        *build_arguments.project,
+                        *(
+                            ()
+                            if build_arguments.manifest is None
+                            else (build_arguments.manifest,)
+                        ),
+                    )
+                ),
+                arguments=arguments,
+                os_names=set(
+                    os_name
+                    for os_name in common.os_to_configuration
+                    if os_regex.match(os_name) is not None
+                ),
+                connection=connection,
+            )
+            self.next_identifier += 1
+            self.queue.append(job)
+            common.print_info(f"Queued {job.name()}")
+            job.send(
+                {
+                    "event": "queued",
+                    "job": job.identifier,
+                    "ahead": len(self.queue) - 1 + len(self.running),
+                }
+            )
+            self.schedule()
+        return job
+
+    def schedule(self) -> None:
+        busy_os_names = set(os_name for job in self.running for os_name in job.os_names)
+        for job in list(self.queue):
+            if len(self.running) >= self.jobs:
+                break
+            if busy_os_names.isdisjoint(job.os_names):
+                self.queue.remove(job)
+                self.running.append(job)
+                threading.Thread(target=self.run, args=(job,), daemon=True).start()
+            busy_os_names.update(job.os_names)
+
+    def run(self, job: Job) -> None:
+        common.print_info(f"Started {job.name()}")
+        job.send({"event": "started", "job": job.identifier})
+        begin = time.monotonic()
+        environment = dict(os.environ)
+        environment["PYTHONPATH"] = os.pathsep.join(
+            path
+            for path in (str(dirname.parent), environment.get("PYTHONPATH"))
+            if path is not None and len(path) > 0
+        )
+        returncode = 1
+        try:
+            with self.lock:
+                if job.cancelled:
+                    return
+                job.process = subprocess.Popen(
+                    (
+                        sys.executable,
+                        "-m",
+                        "cubuzoa",
+                        "build",
+                        *job.arguments,
+                        "--build",
+                        str(self.build),
+                    ),
+                    cwd=job.cwd,
+                    env=environment,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    start_new_session=True,
+                )
+            assert job.process.stdout is not None
+            for line in job.process.stdout:
+                job.send(
+                    {
+                        "event": "output",
+                        "line": line.decode("utf-8", errors="replace").rstrip("\n"),
+                    }
+                )
+            returncode = job.process.wait()
+            if returncode < 0:
+                returncode = 128 - returncode
+        except Exception as error:
+            job.send({"event": "output", "line": common.format_error(str(error))})
+        finally:
+            common.print_info(
+                f"Finished {job.name()} with exit code {returncode} in {common.format_duration(time.monotonic() - begin)}"
+            )
+            job.send(
+                {"event": "finished", "job": job.identifier, "returncode": returncode}
+            )
+            with self.lock:
+                self.running.remove(job)
+                job.done.set()
+                self.schedule()
+
+    def cancel(self, job: Job) -> None:
+        with self.lock:
+            if job.done.is_set() or job.cancelled:
+                return
+            job.cancelled = True
+            if job in self.queue:
+                common.print_info(f"Cancelled {job.name()}")
+                self.queue.remove(job)
+                job.done.set()
+                self.schedule()
+            elif job.process is not None and job.process.poll() is None:
+                common.print_info(f"Interrupting {job.name()}")
+                os.killpg(job.process.pid, signal.SIGINT)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        server = typing.cast(Server, self.server)
+        try:
+            request = json.loads(self.rfile.readline())
+            if request["command"] != "build":
+                raise ValueError(f'unknown command "{request["command"]}"')
+            cwd = str(request["cwd"])
+            arguments = [str(argument) for argument in request["arguments"]]
+        except (ValueError, KeyError, TypeError) as error:
+            self.wfile.write(
+                json.dumps({"event": "error", "message": str(error)}).encode("utf-8")
+                + b"\n"
+            )
+            return
+        job = server.add(cwd, arguments, self.connection)
+        if job is None:
+            self.wfile.write(
+                json.dumps(
+                    {"event": "error", "message": "invalid build arguments"}
+                ).encode("utf-8")
+                + b"\n"
+            )
+            return
+        # the client sends nothing else, so the read returns when it disconnects
+        while not job.done.is_set():
+            try:
+                if len(self.connection.recv(1024)) == 0:
+                    break
+            except OSError:
+                break
+        if not job.done.is_set():
+            server.cancel(job)
+        job.done.wait()
+
+
+def serve(
+    socket_path: pathlib.Path,
+    build: pathlib.Path,
+    jobs: int,
+    parse_build_arguments: typing.Callable[[list[str]], argparse.Namespace],
+) -> None:
+    if socket_path.is_socket():
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(str(socket_path))
+            except ConnectionRefusedError:
+                socket_path.unlink()
+            else:
+                raise Exception(f'another server is listening on "{socket_path}"')
+    with Server(socket_path, build, jobs, parse_build_arguments) as server:
+        common.print_info(f"Listening on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            socket_path.unlink(missing_ok=True)
+
+
+def submit(socket_path: pathlib.Path, arguments: list[str]) -> int:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(str(socket_path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            common.print_error(
+                f'no server is listening on "{socket_path}", start one with python3 -m cubuzoa serve'
+            )
+            return 1
+        connection.sendall(
+            json.dumps(
+                {"command": "build", "cwd": os.getcwd(), "arguments": arguments}
+            ).encode("utf-8")
+            + b"\n"
+        )
+        try:
+            with connection.makefile("r", encoding="utf-8") as messages:
+                for line in messages:
+                    message = json.loads(line)
+                    if message["event"] == "queued":
+                        common.print_info(
+                            f"Queued job {message['job']} ({message['ahead']} job{'' if message['ahead'] == 1 else 's'} ahead)"
+                        )
+                    elif message["event"] == "started":
+                        common.print_info(f"Started job {message['job']}")
+                    elif message["event"] == "output":
+                        print(message["line"], flush=True)
+                    elif message["event"] == "finished":
+                        return message["returncode"]
+                    elif message["event"] == "error":
+                        common.print_error(message["message"])
+                        return 1
+        except KeyboardInterrupt:
+            common.print_error("interrupted, the server cancels the build")
+            return 130
+    common.print_error("the server closed the connection")
+    return 1